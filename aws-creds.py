@@ -1,31 +1,39 @@
-#!/usr/bin/env -S uv run
+#!/usr/bin/env python3
 # /// script
 # requires-python = ">=3.10"
 # dependencies = [
 #     "boto3",
-#     "click",
+#     "pyyaml",
 # ]
 # ///
-from datetime import datetime, timezone
+# Cache hits only import stdlib modules (this script may run before every `aws` command, as `credential_process`).
+# Cache misses import botocore and yaml lazily, re-running under `uv run --script` (which installs the dependencies
+# above) if they aren't available.
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
 import json
 import re
-from configparser import ConfigParser
+from contextlib import contextmanager, nullcontext
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
 from functools import partial
 from getpass import getuser
-from os import remove, environ, makedirs
-from os.path import expanduser, join, exists, dirname
+from glob import glob
+from os import execvp, fdopen, fsync, remove, replace, environ, makedirs, stat
+from os.path import abspath, basename, expanduser, join, exists, dirname, splitext
 from subprocess import check_output
-from sys import stderr, stdout
+from sys import argv, stderr, stdout
+from tempfile import mkstemp
+from time import sleep
 from typing import Callable
 
-import yaml
-from click import command, argument, option
-from dateutil.parser import parse
-
-SECTION_RGX = re.compile(r'profile (?P<profile>\w+)')
+SECTION_RGX = re.compile(r'profile (?P<profile>.+)')
 AWS_CONFIG_DIR = expanduser('~/.aws')
 DEFAULT_CREDS_DIR = join(AWS_CONFIG_DIR, 'creds')
 DEFAULT_CREDS_CONFIG_NAME = 'creds.yml'
+CONFIG_CACHE_NAME = '.config.pickle'
+CONFIG_CACHE_VERSION = 1
 
 err = partial(print, file=stderr)
 
@@ -79,68 +87,228 @@ def run_json(
     return json.loads(output)
 
 
-def load_creds(
-    no_cache_level: int,
-    creds_dir: str,
-    quiet: bool,
-    session_name: str | None,
-    profile_name: str,
-):
-    def log(msg: str):
-        if not quiet:
-            err(f"{profile_name}: {msg}")
+AWS_CREDS_NO_CACHE_LEVEL_VAR = 'AWS_CREDS_NO_CACHE_LEVEL'
+AWS_CREDS_SUBPROCESS_VAR = 'AWS_CREDS_SUBPROCESS'
+AWS_CREDS_REFRESH_MARGIN_VAR = 'AWS_CREDS_REFRESH_MARGIN'
+AWS_CREDS_REEXEC_VAR = 'AWS_CREDS_REEXEC'
+DEFAULT_DAEMON_REFRESH_MARGIN = 600
 
-    def log_json(obj, **kwargs):
-        if not quiet:
-            json.dump(obj, stderr, **kwargs)
-            err()
+_sessions = {}
+_configs = {}
 
-    if not profile_name:
-        profile_name = environ.get('AWS_PROFILE')
-        if not profile_name:
-            raise RuntimeError("No <profile> passed, and AWS_PROFILE not set")
-    creds_path = join(creds_dir, f'{profile_name}.json')
-    creds = None
-    if no_cache_level:
-        log(f"skipping checking for cached creds at {creds_path}")
-    elif exists(creds_path):
-        with open(creds_path, 'r') as f:
-            creds = json.load(f)
-        expiration_str = creds['Expiration']
-        expiration = parse(expiration_str)
 
-        now = datetime.now(timezone.utc)
-        if expiration <= now:
-            log(f"cached creds at {creds_path} expired at {expiration_str}; removing:")
-            log_json(creds)
-            remove(creds_path)
-            creds = None
-        else:
-            log(f"using cached creds from {creds_path}")
-    else:
-        log(f"no cached creds found at {creds_path}")
+def parse_expiration(expiration_str: str) -> datetime:
+    """Parse an ISO 8601 `Expiration` (e.g. `2025-05-07T16:00:00Z`, `2025-05-07T16:00:00.123456+00:00`)."""
+    # `datetime.fromisoformat` only accepts a "Z" suffix as of Python 3.11
+    if expiration_str.endswith('Z'):
+        expiration_str = expiration_str[:-1] + '+00:00'
+    return datetime.fromisoformat(expiration_str)
+
+
+def ensure_deps(log: Callable[[str], None]):
+    """Make sure the cache-miss dependencies (botocore, yaml) are importable, re-running this script under
+    `uv run --script` if they aren't."""
+    try:
+        import botocore.session  # noqa: F401
+        import yaml  # noqa: F401
+    except ImportError:
+        if environ.get(AWS_CREDS_REEXEC_VAR):
+            raise
+        log("botocore/yaml not found; re-running under `uv run --script`")
+        environ[AWS_CREDS_REEXEC_VAR] = '1'
+        execvp('uv', ['uv', 'run', '--quiet', '--script', abspath(__file__), *argv[1:]])
+
+
+def get_session(profile_name: str | None = None):
+    """Memoized botocore session (optionally bound to ``profile_name``), so STS models and config are loaded once per process."""
+    if profile_name not in _sessions:
+        from botocore.session import Session
+        _sessions[profile_name] = Session(profile=profile_name)
+    return _sessions[profile_name]
+
+
+def env_no_cache_level() -> int:
+    return int(environ.get(AWS_CREDS_NO_CACHE_LEVEL_VAR) or 0)
+
+
+def env_refresh_margin() -> int:
+    return int(environ.get(AWS_CREDS_REFRESH_MARGIN_VAR) or 0)
 
+
+def is_chained(profile) -> bool:
+    """Whether ``profile`` is resolved by this script (AssumeRole or MFA session), vs. a plain keypair."""
+    return 'role_arn' in profile or 'mfa_serial' in profile
+
+
+def session_creds(profile_name: str | None) -> dict[str, str]:
+    """Resolve a plain (keypair) profile via botocore's credential chain; `None` means the `[default]` keypair."""
+    creds = get_session(profile_name or 'default').get_credentials()
     if not creds:
-        config = ConfigParser()
-        config.read(expanduser('~/.aws/config'))
-        profile_key = f'profile {profile_name}'
-        profile = config[profile_key]
-        creds = None
-        if 'role_arn' in profile:
-            role_arn = profile['role_arn']
-            duration_seconds = profile.get('duration_seconds')
-            source_profile = profile.get('source_profile')
-            if source_profile:
-                env = None
-                envs = { 'AWS_PROFILE': source_profile }
-            else:
-                env = {**environ}
-                del env['AWS_PROFILE']
-                envs = None
+        raise RuntimeError(f"No credentials found for profile {profile_name or 'default'}")
+    frozen = creds.get_frozen_credentials()
+    rv = { 'AccessKeyId': frozen.access_key, 'SecretAccessKey': frozen.secret_key }
+    if frozen.token:
+        rv['SessionToken'] = frozen.token
+    return rv
+
+
+def sts_client(creds: dict[str, str], region: str | None = None):
+    session = get_session()
+    return session.create_client(
+        'sts',
+        # STS's global endpoint lives in us-east-1
+        region_name=region or session.get_config_variable('region') or 'us-east-1',
+        aws_access_key_id=creds['AccessKeyId'],
+        aws_secret_access_key=creds['SecretAccessKey'],
+        aws_session_token=creds.get('SessionToken'),
+    )
+
+
+def serialize_creds(creds: dict) -> dict[str, str]:
+    """Convert boto3 `Credentials` (with a `datetime` `Expiration`) to the `aws sts …` JSON shape."""
+    return {
+        k: v.isoformat() if isinstance(v, datetime) else v
+        for k, v in creds.items()
+    }
+
+
+def aws_config_path() -> str:
+    return environ.get('AWS_CONFIG_FILE') or join(AWS_CONFIG_DIR, 'config')
+
+
+def creds_config_path(creds_dir: str) -> str:
+    return join(dirname(creds_dir), DEFAULT_CREDS_CONFIG_NAME)
+
+
+def stat_key(path: str) -> tuple[int, int, int] | None:
+    try:
+        st = stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def compile_config(config_path: str, mfa_config_path: str) -> tuple[dict[str, dict[str, str]], dict[str, str]]:
+    """Parse ``config_path`` into ``{profile name: settings}``, and ``mfa_config_path`` (`creds.yml`) into
+    ``{MFA ARN: OTP command}``."""
+    from configparser import ConfigParser
+    config = ConfigParser()
+    config.read(config_path)
+    profiles = {}
+    for section in config.sections():
+        m = SECTION_RGX.fullmatch(section)
+        if m:
+            profiles[m['profile']] = dict(config[section])
+        elif section == 'default':
+            profiles[section] = dict(config[section])
+
+    mfa_cmds = {}
+    if exists(mfa_config_path):
+        import yaml
+        with open(mfa_config_path, 'r') as f:
+            creds_config = yaml.safe_load(f)
+        # First entry wins, for duplicate ARNs
+        for mfa_config in reversed(creds_config.get('mfa') or []):
+            mfa_cmds[mfa_config['arn']] = mfa_config['cmd']
+    return profiles, mfa_cmds
+
+
+def load_config(creds_dir: str, log: Callable[[str], None]) -> tuple[dict[str, dict[str, str]], dict[str, str]]:
+    """Compiled ``(profiles, mfa_cmds)`` (see `compile_config`), memoized in-process and pickled to
+    `<creds_dir>/.config.pickle`; both are keyed by the source files' (inode, size, mtime), so editing either file
+    invalidates them."""
+    import pickle
+    config_path = aws_config_path()
+    mfa_config_path = creds_config_path(creds_dir)
+    key = (CONFIG_CACHE_VERSION, config_path, stat_key(config_path), mfa_config_path, stat_key(mfa_config_path))
+    if key in _configs:
+        return _configs[key]
+
+    cache_path = join(creds_dir, CONFIG_CACHE_NAME)
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['key'] == key:
+            _configs[key] = cache['profiles'], cache['mfa_cmds']
+            return _configs[key]
+        log(f"{config_path} or {mfa_config_path} changed; recompiling {cache_path}")
+    except FileNotFoundError:
+        log(f"compiling {config_path} and {mfa_config_path} to {cache_path}")
+    except Exception as e:
+        log(f"error reading {cache_path} ({e}); recompiling")
+
+    profiles, mfa_cmds = compile_config(config_path, mfa_config_path)
+    atomic_write(cache_path, pickle.dumps(dict(key=key, profiles=profiles, mfa_cmds=mfa_cmds)))
+    _configs[key] = profiles, mfa_cmds
+    return _configs[key]
+
+
+def load_mfa_cmd(creds_dir: str, mfa_cmds: dict[str, str], mfa_serial: str) -> str:
+    mfa_cmd = mfa_cmds.get(mfa_serial)
+    if not mfa_cmd:
+        raise RuntimeError(f"No MFA config found in {creds_config_path(creds_dir)} for ARN {mfa_serial}")
+    return mfa_cmd
+
+
+def subprocess_env(source_profile: str | None, no_cache_level: int = 0) -> tuple[dict[str, str] | None, dict[str, str] | None]:
+    """(env, envs) for an `aws sts …` subprocess that should authenticate as ``source_profile`` (whose
+    `credential_process` inherits ``no_cache_level``)."""
+    if source_profile:
+        return None, {
+            'AWS_PROFILE': source_profile,
+            **({ AWS_CREDS_NO_CACHE_LEVEL_VAR: str(no_cache_level) } if no_cache_level else {}),
+        }
+    else:
+        env = {**environ}
+        env.pop('AWS_PROFILE', None)
+        return env, None
+
+
+def fetch_creds(
+    profiles: dict[str, dict[str, str]],
+    mfa_cmds: dict[str, str],
+    profile_name: str,
+    session_name: str | None,
+    creds_dir: str,
+    subprocess: bool,
+    refresh_margin: int,
+    log: Callable[[str], None],
+    quiet: bool,
+    no_cache_level: int = 0,
+) -> dict[str, str] | None:
+    """Fetch fresh credentials for ``profile_name`` from STS.
+
+    By default, STS is called in-process, and chained `source_profile`s are resolved by recursing into
+    `load_creds` (which consults their caches, per ``no_cache_level``). With ``subprocess``, shells out to `aws sts …`
+    instead (the AWS CLI then runs `credential_process` for the source profile itself).
+    """
+    if profile_name not in profiles:
+        raise RuntimeError(f"No profile {profile_name} found in {aws_config_path()}")
+    profile = profiles[profile_name]
+    duration_seconds = profile.get('duration_seconds')
+    source_profile = profile.get('source_profile')
+
+    def get_source_creds():
+        if source_profile in profiles and is_chained(profiles[source_profile]):
+            log(f"loading source profile {source_profile}")
+            return load_creds(
+                no_cache_level=no_cache_level,
+                creds_dir=creds_dir,
+                quiet=quiet,
+                session_name=None,
+                profile_name=source_profile,
+                subprocess=subprocess,
+                refresh_margin=refresh_margin,
+            )
+        return session_creds(source_profile)
 
-            if not session_name:
-                user = getuser()
-                session_name = f'{user}-{profile_name}'
+    if 'role_arn' in profile:
+        role_arn = profile['role_arn']
+        if not session_name:
+            user = getuser()
+            session_name = f'{user}-{profile_name}'
+        if subprocess:
+            env, envs = subprocess_env(source_profile, no_cache_level)
             resp = run_json(
                 [
                     'aws', 'sts', 'assume-role',
@@ -152,32 +320,22 @@ def load_creds(
                 env=env,
                 envs=envs,
             )
-            creds = resp['Credentials']
-        elif 'mfa_serial' in profile:
-            mfa_serial = profile['mfa_serial']
-            duration_seconds = profile.get('duration_seconds')
-            source_profile = profile.get('source_profile')
-            if source_profile:
-                env = None
-                envs = { 'AWS_PROFILE': source_profile }
-            else:
-                env = {**environ}
-                del env['AWS_PROFILE']
-                envs = None
-
-            creds_config_path = join(dirname(creds_dir), DEFAULT_CREDS_CONFIG_NAME)
-            with open(creds_config_path, 'r') as f:
-                creds_config = yaml.safe_load(f)
-            mfa_configs = creds_config['mfa']
-            mfa_cmd = None
-            for mfa_config in mfa_configs:
-                if mfa_config['arn'] == mfa_serial:
-                    mfa_cmd = mfa_config['cmd']
-                    break
-            if not mfa_cmd:
-                raise RuntimeError(f"No MFA config found in {creds_config_path} for ARN {mfa_serial}")
+            return resp['Credentials']
+        sts = sts_client(get_source_creds(), region=profile.get('region'))
+        log(f"AssumeRole {role_arn} (session {session_name})")
+        resp = sts.assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=session_name,
+            **({ 'DurationSeconds': int(duration_seconds) } if duration_seconds else {}),
+        )
+        return serialize_creds(resp['Credentials'])
+    elif 'mfa_serial' in profile:
+        mfa_serial = profile['mfa_serial']
+        mfa_cmd = load_mfa_cmd(creds_dir, mfa_cmds, mfa_serial)
+        if subprocess:
             mfa_code = run(mfa_cmd, log=log)
             log(f"MFA code {mfa_code}")
+            env, envs = subprocess_env(source_profile, no_cache_level)
             resp = run_json(
                 [
                     'aws', 'sts', 'get-session-token',
@@ -189,52 +347,192 @@ def load_creds(
                 env=env,
                 envs=envs,
             )
-            creds = resp['Credentials']
+            return resp['Credentials']
+        sts = sts_client(get_source_creds(), region=profile.get('region'))
+        mfa_code = run(mfa_cmd, log=log)
+        log(f"MFA code {mfa_code}")
+        resp = sts.get_session_token(
+            SerialNumber=mfa_serial,
+            TokenCode=mfa_code,
+            **({ 'DurationSeconds': int(duration_seconds) } if duration_seconds else {}),
+        )
+        return serialize_creds(resp['Credentials'])
+    return None
+
+
+def read_cached_creds(
+    creds_path: str,
+    refresh_margin: int,
+    log: Callable[[str], None],
+) -> tuple[dict[str, str] | None, dict[str, str] | None]:
+    """Return ``(creds, stale_creds)``: cached creds valid beyond ``refresh_margin``, or still-valid creds within it."""
+    if not exists(creds_path):
+        log(f"no cached creds found at {creds_path}")
+        return None, None
+    with open(creds_path, 'r') as f:
+        creds = json.load(f)
+    expiration_str = creds['Expiration']
+    expiration = parse_expiration(expiration_str)
+
+    now = datetime.now(timezone.utc)
+    if expiration <= now:
+        log(f"cached creds at {creds_path} expired at {expiration_str}")
+        return None, None
+    elif expiration - timedelta(seconds=refresh_margin) <= now:
+        log(f"cached creds at {creds_path} expire at {expiration_str}, within refresh margin ({refresh_margin}s); refreshing")
+        return None, creds
+    else:
+        log(f"using cached creds from {creds_path}")
+        return creds, None
+
+
+@contextmanager
+def creds_lock(creds_dir: str, profile_name: str, log: Callable[[str], None]):
+    """Exclusive per-profile lock, so that concurrent callers refresh a profile's creds at most once.
+
+    Yields whether another process held the lock first (in which case the cache should be re-checked).
+    """
+    makedirs(creds_dir, exist_ok=True)
+    with open(join(creds_dir, f'{profile_name}.lock'), 'a') as f:
+        try:
+            flock(f, LOCK_EX | LOCK_NB)
+            waited = False
+        except BlockingIOError:
+            log("waiting for another process to refresh creds")
+            flock(f, LOCK_EX)
+            waited = True
+        try:
+            yield waited
+        finally:
+            flock(f, LOCK_UN)
+
+
+def atomic_write(path: str, data: bytes):
+    """Write ``data`` to a temp file (readable only by the current user) and rename it over ``path``, so readers
+    never see a partially-written file."""
+    dir = dirname(path)
+    makedirs(dir, exist_ok=True)
+    fd, tmp_path = mkstemp(dir=dir, prefix=f'.{basename(path)}.', suffix='.tmp')
+    try:
+        with fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            fsync(f.fileno())
+        replace(tmp_path, path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+
+
+def write_creds(creds_path: str, creds: dict[str, str]):
+    atomic_write(creds_path, json.dumps(creds, indent=2).encode())
+
+
+def load_creds(
+    no_cache_level: int,
+    creds_dir: str,
+    quiet: bool,
+    session_name: str | None,
+    profile_name: str,
+    subprocess: bool = False,
+    refresh_margin: int = 0,
+):
+    """Load creds for ``profile_name``, from cache if they're valid for at least ``refresh_margin`` more seconds.
+
+    Cached creds that are still valid, but within the refresh margin, are refreshed; if that fails, they are
+    returned as-is (with a warning).
+    """
+    def log(msg: str):
+        if not quiet:
+            err(f"{profile_name}: {msg}")
+
+    def log_json(obj, **kwargs):
+        if not quiet:
+            json.dump(obj, stderr, **kwargs)
+            err()
+
+    if not profile_name:
+        profile_name = environ.get('AWS_PROFILE')
+        if not profile_name:
+            raise RuntimeError("No <profile> passed, and AWS_PROFILE not set")
+    creds_path = join(creds_dir, f'{profile_name}.json')
+    creds = None
+    stale_creds = None
+    if no_cache_level:
+        log(f"skipping checking for cached creds at {creds_path}")
+    else:
+        creds, stale_creds = read_cached_creds(creds_path, refresh_margin, log=log)
+        if creds:
+            return creds
+
+    # Before taking the lock: re-running under `uv` would drop it
+    ensure_deps(log)
+    with creds_lock(creds_dir, profile_name, log=log) if no_cache_level < 2 else nullcontext(False) as waited:
+        if waited and not no_cache_level:
+            # Another process held the lock, and has likely just refreshed the cache
+            creds, stale_creds = read_cached_creds(creds_path, refresh_margin, log=log)
+            if creds:
+                return creds
+
+        profiles, mfa_cmds = load_config(creds_dir, log=log)
+        try:
+            creds = fetch_creds(
+                profiles=profiles,
+                mfa_cmds=mfa_cmds,
+                profile_name=profile_name,
+                session_name=session_name,
+                creds_dir=creds_dir,
+                subprocess=subprocess,
+                refresh_margin=refresh_margin,
+                log=log,
+                quiet=quiet,
+                no_cache_level=no_cache_level,
+            )
+        except Exception as e:
+            if not stale_creds:
+                raise
+            log(f"refresh failed ({e}); using cached creds from {creds_path}")
+            return stale_creds
         if creds:
             if no_cache_level > 1:
                 log(f"skipping writing credentials to cache path {creds_path}")
             else:
                 log(f"saving credentials to {creds_path}:")
                 log_json(creds)
-                makedirs(creds_dir, exist_ok=True)
-                with open(creds_path, 'w') as f:
-                    json.dump(creds, f, indent=2)
+                write_creds(creds_path, creds)
 
     return creds
 
 
-AWS_CREDS_NO_CACHE_LEVEL_VAR = 'AWS_CREDS_NO_CACHE_LEVEL'
-
-
-@command("aws-creds.py")
-@option('-C', '--no-cache', 'no_cache_level', count=True, help=f"0x: read and write creds from cache; 1x: skip reading, but write new creds; 2x: don't read or write creds. Falls back to ${AWS_CREDS_NO_CACHE_LEVEL_VAR} (should be \"0\", \"1\", or \"2\").")
-@option('-d', '--creds-dir', default=DEFAULT_CREDS_DIR, help=f"Directory to cache creds in; defaults to {DEFAULT_CREDS_DIR}")
-@option('-o', '--output-format', default='json', help='Output credentials as JSON ("j", "json"), shell ("s", "sh", "shell"), or env ("e", "env") formats')
-@option('-q', '--quiet', is_flag=True, help="Suppress logging to stderr")
-@option('-s', '--session-name', help="Session name (passed to `aws sts assume-role … --role-session-name`)")
-@argument("profile", required=False)
 def main(
     no_cache_level: int,
     creds_dir: str,
     output_format: str | None,
+    refresh_margin: int | None,
     quiet: bool,
     session_name: str | None,
+    subprocess: bool,
     profile: str,
 ):
     """AWS credentials helper, suitable for use as `credentials_process` in one or more `[profile …]` sections of ~/.aws/config.
 
-    Caches credentials in `~/.aws/creds/<profile>.json`.
+    Caches credentials in `~/.aws/creds/<profile>.json`. Run `aws-creds.py daemon` to renew cached creds before
+    they expire.
     """
     if not no_cache_level:
-        env_no_cache_level = environ.get(AWS_CREDS_NO_CACHE_LEVEL_VAR)
-        if env_no_cache_level:
-            no_cache_level = int(env_no_cache_level)
+        no_cache_level = env_no_cache_level()
+    if not subprocess:
+        subprocess = environ.get(AWS_CREDS_SUBPROCESS_VAR) == '1'
+    if refresh_margin is None:
+        refresh_margin = env_refresh_margin()
     creds = load_creds(
         no_cache_level=no_cache_level,
         creds_dir=creds_dir,
         quiet=quiet,
         session_name=session_name,
         profile_name=profile,
+        subprocess=subprocess,
+        refresh_margin=refresh_margin,
     )
     if output_format in ['s', 'sh', 'shell']:
         envs = creds_to_envs(creds)
@@ -250,5 +548,84 @@ def main(
             print(f"{k}={v}")
 
 
+def cached_expiration(creds_path: str) -> datetime | None:
+    try:
+        with open(creds_path, 'r') as f:
+            return parse_expiration(json.load(f)['Expiration'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def daemon(
+    creds_dir: str,
+    max_interval: int,
+    refresh_margin: int,
+    once: bool,
+    quiet: bool,
+    subprocess: bool,
+    profiles: list[str],
+):
+    """Renew cached creds (for `profiles`, or every `<profile>.json` in the creds dir) before they expire, so that
+    `credential_process` invocations are served from a warm cache."""
+    while True:
+        names = profiles or sorted(splitext(basename(path))[0] for path in glob(join(creds_dir, '*.json')))
+        for name in names:
+            try:
+                load_creds(
+                    no_cache_level=0,
+                    creds_dir=creds_dir,
+                    quiet=quiet,
+                    session_name=None,
+                    profile_name=name,
+                    subprocess=subprocess,
+                    refresh_margin=refresh_margin,
+                )
+            except Exception as e:
+                err(f"{name}: renewal failed: {e}")
+        if once:
+            return
+
+        now = datetime.now(timezone.utc)
+        wait = max_interval
+        for name in names:
+            expiration = cached_expiration(join(creds_dir, f'{name}.json'))
+            if expiration:
+                due = (expiration - timedelta(seconds=refresh_margin) - now).total_seconds()
+                # Already due means renewal just failed (or creds are shorter-lived than the margin); retry at `max_interval`
+                if due > 0:
+                    wait = min(wait, due)
+        if not quiet:
+            err(f"sleeping {wait:.0f}s")
+        sleep(wait)
+
+
+def main_parser() -> ArgumentParser:
+    parser = ArgumentParser('aws-creds.py', description=main.__doc__)
+    parser.add_argument('-C', '--no-cache', dest='no_cache_level', action='count', default=0, help=f"0x: read and write creds from cache; 1x: skip reading, but write new creds; 2x: don't read or write creds. Falls back to ${AWS_CREDS_NO_CACHE_LEVEL_VAR} (should be \"0\", \"1\", or \"2\").")
+    parser.add_argument('-d', '--creds-dir', default=DEFAULT_CREDS_DIR, help=f"Directory to cache creds in; defaults to {DEFAULT_CREDS_DIR}")
+    parser.add_argument('-o', '--output-format', default='json', help='Output credentials as JSON ("j", "json"), shell ("s", "sh", "shell"), or env ("e", "env") formats')
+    parser.add_argument('-m', '--refresh-margin', type=int, help=f"Refresh cached creds that expire within this many seconds (default: 0, i.e. only once expired). Falls back to ${AWS_CREDS_REFRESH_MARGIN_VAR}.")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Suppress logging to stderr")
+    parser.add_argument('-s', '--session-name', help="Session name (passed to `aws sts assume-role … --role-session-name`)")
+    parser.add_argument('-S', '--subprocess', action='store_true', help=f"Fetch creds by shelling out to `aws sts …`, instead of calling STS in-process. Falls back to ${AWS_CREDS_SUBPROCESS_VAR} (\"1\" enables).")
+    parser.add_argument('profile', nargs='?')
+    return parser
+
+
+def daemon_parser() -> ArgumentParser:
+    parser = ArgumentParser('aws-creds.py daemon', description=daemon.__doc__)
+    parser.add_argument('-d', '--creds-dir', default=DEFAULT_CREDS_DIR, help=f"Directory to cache creds in; defaults to {DEFAULT_CREDS_DIR}")
+    parser.add_argument('-i', '--max-interval', type=int, default=300, help="Maximum seconds to sleep between checks (default: 300)")
+    parser.add_argument('-m', '--refresh-margin', type=int, default=DEFAULT_DAEMON_REFRESH_MARGIN, help=f"Renew creds that expire within this many seconds (default: {DEFAULT_DAEMON_REFRESH_MARGIN})")
+    parser.add_argument('-1', '--once', action='store_true', help="Make one renewal pass and exit (e.g. for cron)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Suppress logging to stderr")
+    parser.add_argument('-S', '--subprocess', action='store_true', help="Fetch creds by shelling out to `aws sts …`, instead of calling STS in-process.")
+    parser.add_argument('profiles', nargs='*')
+    return parser
+
+
 if __name__ == '__main__':
-    main()
+    if argv[1:2] == ['daemon']:
+        daemon(**vars(daemon_parser().parse_args(argv[2:])))
+    else:
+        main(**vars(main_parser().parse_args()))
@@ -1,11 +1,18 @@
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from functools import partial
+from itertools import islice
 import json
 import re
 
 import boto3
 
 
+DEFAULT_JOBS = 8
+DURATION_UNITS = { 's': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks' }
+
+
 def default(o):
     if isinstance(o, datetime):
         return o.isoformat()
@@ -16,6 +23,16 @@ def default(o):
 to_json = partial(json.dumps, indent=4, default=default)
 
 
+def format_table(rows, headers):
+    """Left-aligned, space-padded columns, with a header row."""
+    rows = [ headers, *rows ]
+    widths = [ max(len(str(row[idx])) for row in rows) for idx in range(len(headers)) ]
+    return '\n'.join(
+        '  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
+
+
 def rgx_filter(all_names, fullmatch, regexs, key=None):
     if regexs:
         match_fn = re.fullmatch if fullmatch else re.search
@@ -32,19 +49,75 @@ def rgx_filter(all_names, fullmatch, regexs, key=None):
     return names
 
 
-def get_page(client, cmd, max_num, **kwargs):
-    paginator = client.get_paginator(cmd)
-    page_iterator = paginator.paginate(
-        **kwargs,
-        PaginationConfig={ 'MaxItems': max_num if max_num else None },
-    )
-    page = next(page for page in page_iterator)
-    return page
+def parse_since(since):
+    """Parse an absolute (ISO 8601) time, or a duration ago (e.g. `30m`, `12h`, `7d`), to a UTC `datetime`."""
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw])', since.strip())
+    if m:
+        num, unit = m.groups()
+        return datetime.now(timezone.utc) - timedelta(**{ DURATION_UNITS[unit]: float(num) })
+    # `datetime.fromisoformat` only accepts a "Z" suffix as of Python 3.11
+    if since.endswith('Z'):
+        since = since[:-1] + '+00:00'
+    dt = datetime.fromisoformat(since)
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
 
 
 def founds(resp, key, not_found_key=None):
     not_found_key = not_found_key if not_found_key else f'{key}NotFound'
-    not_founds = resp[not_found_key]
+    not_founds = resp.get(not_found_key)
     if not_founds:
         raise RuntimeError("%s:\n%s" % (not_found_key, to_json(not_founds)))
     return resp[key]
+
+
+def paginate(client, cmd, key, max_num=None, **kwargs):
+    """Lazily yield the `key` items from every page of `cmd` (at most `max_num` of them, if given)."""
+    paginator = client.get_paginator(cmd)
+    page_iterator = paginator.paginate(
+        **kwargs,
+        PaginationConfig={ 'MaxItems': max_num if max_num else None },
+    )
+    for page in page_iterator:
+        yield from page[key]
+
+
+def chunks(items, size):
+    """Lazily split `items` into lists of at most `size` items."""
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def imap(fn, items, jobs=DEFAULT_JOBS):
+    """Like `map(fn, items)`, but calling `fn` on a pool of `jobs` threads.
+
+    `items` is consumed lazily, with at most `jobs` calls in flight, and results are yielded in order."""
+    inflight = deque()
+    with ThreadPoolExecutor(jobs) as pool:
+        try:
+            for item in items:
+                inflight.append(pool.submit(fn, item))
+                if len(inflight) >= jobs:
+                    yield inflight.popleft().result()
+            while inflight:
+                yield inflight.popleft().result()
+        finally:
+            for future in inflight:
+                future.cancel()
+
+
+def batch_get(fn, ids, key, ids_key='ids', item_key=None, not_found_key=None, batch_size=100, jobs=DEFAULT_JOBS):
+    """Yield the `key` items of `fn(**{ids_key: batch})` (e.g. `batch_get_builds(ids=...)`), for `batch_size`-ID
+    batches of `ids` (which may be a lazy `paginate` stream), fetched `jobs` batches at a time.
+
+    Items are yielded in the order of `ids` (each batch's items are reordered by their `item_key` field, if given, as
+    the batch APIs don't promise to preserve it). Raises if any IDs aren't found (see `founds`)."""
+    def get(batch):
+        items = founds(fn(**{ ids_key: batch }), key, not_found_key)
+        if item_key:
+            idxs = { id: idx for idx, id in enumerate(batch) }
+            items = sorted(items, key=lambda item: idxs.get(item[item_key], len(batch)))
+        return items
+
+    for items in imap(get, chunks(ids, batch_size), jobs=jobs):
+        yield from items
@@ -0,0 +1,61 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "pyyaml",
+# ]
+# ///
+"""Spawn N concurrent `aws-creds.py` callers for one uncached profile (`role` ← `mfa` ← `base`) against a local STS
+stub, and report how many STS calls they made (ideally one per profile in the chain) and the wall-clock time."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+from os.path import dirname, join
+from subprocess import PIPE, Popen
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from click import command, option
+
+from sts_stub import sts_stub, write_aws_home
+
+AWS_CREDS = join(dirname(dirname(os.path.abspath(__file__))), 'aws-creds.py')
+
+
+@command
+@option('-d', '--delay', type=float, default=0.5, help='Seconds each STS call takes (default: 0.5)')
+@option('-n', '--num-callers', type=int, default=32, help='Number of concurrent `aws-creds.py` processes (default: 32)')
+@option('-r', '--rounds', type=int, default=3, help='Number of rounds; the cache is cleared before each (default: 3)')
+def main(delay, num_callers, rounds):
+    with TemporaryDirectory() as home, sts_stub(delay=delay) as (url, calls):
+        write_aws_home(home)
+        env = { **os.environ, 'HOME': home, 'AWS_ENDPOINT_URL_STS': url }
+        env.pop('AWS_PROFILE', None)
+        creds_dir = join(home, '.aws', 'creds')
+        for round in range(rounds):
+            for name in ('mfa.json', 'role.json'):
+                if os.path.exists(join(creds_dir, name)):
+                    os.remove(join(creds_dir, name))
+            calls.clear()
+            start = perf_counter()
+            procs = [
+                Popen([ executable, AWS_CREDS, '-q', 'role' ], env=env, stdout=PIPE)
+                for _ in range(num_callers)
+            ]
+            outs = [ proc.communicate()[0] for proc in procs ]
+            elapsed = perf_counter() - start
+            failed = sum(proc.returncode != 0 for proc in procs)
+            key_ids = { json.loads(out)['AccessKeyId'] for out in outs if out }
+            print(
+                f"round {round + 1}: {num_callers} callers in {elapsed:.2f}s; STS calls: {dict(calls)}; "
+                f"distinct creds returned: {len(key_ids)}; failed: {failed}"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "pyyaml",
+# ]
+# ///
+"""Measure `aws-creds.py` startup: wall-clock per invocation and `python -X importtime` totals, for cache hits
+("warm") and misses ("cold", against a local STS stub).
+
+Results can be appended to a JSONL file (`-o`), to track latency over time."""
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+from datetime import datetime, timezone
+from os.path import dirname, join
+from statistics import median
+from subprocess import DEVNULL, PIPE, run
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from click import command, option
+
+from sts_stub import sts_stub, write_aws_home
+
+ROOT = dirname(dirname(os.path.abspath(__file__)))
+AWS_CREDS = join(ROOT, 'aws-creds.py')
+
+
+def import_times(cmd: list[str], env: dict[str, str], top: int) -> dict:
+    """Run ``cmd`` under `-X importtime`; return the number of modules imported, their total self-time (ms), and
+    the ``top`` slowest top-level imports (by cumulative time)."""
+    stderr = run([ *cmd[:1], '-X', 'importtime', *cmd[1:] ], env=env, stdout=DEVNULL, stderr=PIPE, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    toplevel = sorted(
+        (row for row in rows if not row[2].startswith('  ')),
+        key=lambda row: -row[1],
+    )[:top]
+    return dict(
+        modules=len(rows),
+        self_ms=round(sum(row[0] for row in rows) / 1000, 2),
+        top={ name.strip(): round(cumulative_us / 1000, 2) for _, cumulative_us, name in toplevel },
+    )
+
+
+def wall_times(cmd: list[str], env: dict[str, str], n: int) -> dict:
+    times = []
+    for _ in range(n):
+        start = perf_counter()
+        run(cmd, env=env, stdout=DEVNULL, check=True)
+        times.append((perf_counter() - start) * 1000)
+    return dict(n=n, min_ms=round(min(times), 2), median_ms=round(median(times), 2), max_ms=round(max(times), 2))
+
+
+@command
+@option('-n', '--num-runs', type=int, default=20, help='Invocations per mode (default: 20)')
+@option('-o', '--output', help='Append results (one JSON object per line) to this file')
+@option('-s', '--shebang', is_flag=True, help="Invoke `aws-creds.py` via its shebang, rather than with this script's Python interpreter")
+@option('-t', '--top', type=int, default=8, help='Number of slowest top-level imports to report (default: 8)')
+def main(num_runs, output, shebang, top):
+    base_cmd = [ AWS_CREDS ] if shebang else [ executable, AWS_CREDS ]
+    with TemporaryDirectory() as home, sts_stub() as (url, calls):
+        write_aws_home(home)
+        env = { **os.environ, 'HOME': home, 'AWS_ENDPOINT_URL_STS': url }
+        env.pop('AWS_PROFILE', None)
+        modes = {
+            'warm': [ *base_cmd, '-q', 'role' ],
+            'cold': [ *base_cmd, '-q', '-C', 'role' ],
+        }
+        # Populate the cache
+        run(modes['warm'], env=env, stdout=DEVNULL, check=True)
+        results = {}
+        for mode, cmd in modes.items():
+            results[mode] = dict(
+                wall=wall_times(cmd, env, num_runs),
+                **({} if shebang else dict(imports=import_times(cmd, env, top))),
+            )
+            print(f"{mode}: {json.dumps(results[mode], indent=2)}")
+
+    if output:
+        rev = run([ 'git', 'rev-parse', '--short', 'HEAD' ], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        with open(output, 'a') as f:
+            json.dump(dict(time=datetime.now(timezone.utc).isoformat(), rev=rev, shebang=shebang, **results), f)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
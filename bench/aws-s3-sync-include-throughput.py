@@ -0,0 +1,88 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+# ]
+# ///
+"""Time `aws-s3-sync-include` uploads, downloads, and S3 → S3 copies at various `--jobs` / `--chunk-size` settings,
+against a local MinIO (or moto) server:
+
+    minio server /tmp/minio &  # default credentials: minioadmin / minioadmin
+    AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin \\
+    bench/aws-s3-sync-include-throughput.py -e http://localhost:9000 -n 16 -s 256MB
+
+Each run transfers all files to a fresh destination (prefix or directory), so nothing is skipped as up to date.
+"""
+from os import environ, makedirs
+from os.path import abspath, dirname, join
+from subprocess import DEVNULL, check_call
+import sys
+from sys import executable
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import boto3
+from click import command, option
+
+ROOT = dirname(dirname(abspath(__file__)))
+SCRIPT = join(ROOT, 'aws-s3-sync-include')
+sys.path.insert(0, ROOT)
+
+from s3_includes import size_option
+
+
+def write_files(root: str, n: int, size: int):
+    makedirs(root, exist_ok=True)
+    block = bytes(range(256)) * (1 << 12)
+    for i in range(n):
+        with open(join(root, f'f{i}.bin'), 'wb') as f:
+            remaining = size
+            while remaining:
+                f.write(block[:min(remaining, len(block))])
+                remaining -= min(remaining, len(block))
+
+
+def sync(*args: str) -> float:
+    start = perf_counter()
+    check_call([ executable, SCRIPT, *args ], stdout=DEVNULL, stderr=DEVNULL)
+    return perf_counter() - start
+
+
+@command
+@option('-b', '--bucket', default='aws-s3-sync-include-bench', help='Bucket to create / use (default: "aws-s3-sync-include-bench")')
+@option('-C', '--chunk-sizes', default='8MB,64MB', help='Comma-separated --chunk-size values to time (default: "8MB,64MB")')
+@option('-e', '--endpoint-url', required=True, help='S3 endpoint URL (e.g. MinIO or moto server)')
+@option('-j', '--jobs', 'jobs_list', default='1,4,16', help='Comma-separated --jobs values to time (default: "1,4,16")')
+@option('-n', '--num-files', type=int, default=8, help='Number of files (default: 8)')
+@option('-s', '--size', default='64MB', callback=size_option, help='Size of each file (default: 64MB)')
+def main(bucket, chunk_sizes, endpoint_url, jobs_list, num_files, size):
+    # Picked up by boto3, here and in `aws-s3-sync-include`
+    environ['AWS_ENDPOINT_URL'] = endpoint_url
+    client = boto3.client('s3')
+    try:
+        client.create_bucket(Bucket=bucket)
+    except (client.exceptions.BucketAlreadyOwnedByYou, client.exceptions.BucketAlreadyExists):
+        pass
+
+    total_mb = num_files * size / (1 << 20)
+    print(f"{num_files} files x {size / (1 << 20):,.0f}MiB = {total_mb:,.0f}MiB per run")
+    with TemporaryDirectory() as tmp:
+        src = join(tmp, 'src')
+        write_files(src, num_files, size)
+        for chunk_size in chunk_sizes.split(','):
+            for jobs in map(int, jobs_list.split(',')):
+                name = f'j{jobs}-c{chunk_size}'
+                flags = [ '-j', str(jobs), '-C', chunk_size, '*' ]
+                times = dict(
+                    upload=sync(*flags, src, f's3://{bucket}/{name}/up'),
+                    download=sync(*flags, f's3://{bucket}/{name}/up', join(tmp, name)),
+                    copy=sync(*flags, f's3://{bucket}/{name}/up', f's3://{bucket}/{name}/copy'),
+                )
+                rates = ', '.join(f'{op} {total_mb / elapsed:7,.1f}MiB/s ({elapsed:.2f}s)' for op, elapsed in times.items())
+                print(f"{jobs:>3} jobs, {chunk_size:>5} chunks: {rates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+"""Helpers shared by the `s3-usage.py` benchmarks."""
+
+SUFFIXES = { 'k': 1_000, 'm': 1_000_000, 'g': 1_000_000_000 }
+
+
+def parse_num(s: str) -> int:
+    """Parse a count like ``10k`` or ``1.5m`` (decimal suffixes)."""
+    s = s.strip().lower()
+    if s[-1] in SUFFIXES:
+        return int(float(s[:-1]) * SUFFIXES[s[-1]])
+    return int(s)
@@ -0,0 +1,69 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "numpy",
+#     "pandas>=2.3",
+#     "pyarrow",
+#     "utz",
+# ]
+# ///
+"""Time `s3-usage.py`'s `agg_dirs` on synthetic listings (random directory trees) of various sizes."""
+from os.path import abspath, dirname, join
+from resource import getrusage, RUSAGE_SELF
+from runpy import run_path
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from click import command, option
+
+# Add current directory to path for local imports
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from bench_utils import parse_num
+
+s3_usage = run_path(join(dirname(dirname(abspath(__file__))), 's3-usage.py'))
+agg_dirs = s3_usage['agg_dirs']
+
+
+def synthetic_files(n: int, fanout: int, max_depth: int, seed: int = 0) -> pd.DataFrame:
+    """``n`` files at random depths (1 to ``max_depth`` directories deep), with ``fanout`` possible names per
+    directory level, random sizes, and random mtimes."""
+    rng = np.random.default_rng(seed)
+    depths = rng.integers(1, max_depth + 1, n)
+    path = pd.Series('d' + pd.Series(rng.integers(0, fanout, n)).astype(str))
+    for level in range(1, max_depth):
+        deeper = depths > level
+        comps = 'd' + pd.Series(rng.integers(0, fanout, n)).astype(str)
+        path = path.where(~deeper, path + '/' + comps)
+    path = path + '/f' + pd.Series(np.arange(n)).astype(str)
+    return pd.DataFrame(dict(
+        path=path,
+        size=rng.integers(0, 1 << 30, n, dtype='int64'),
+        mtime=pd.to_datetime(rng.integers(1_500_000_000, 1_700_000_000, n), unit='s'),
+    ))
+
+
+@command
+@option('-d', '--max-depth', type=int, default=6, help='Maximum directory depth (default: 6)')
+@option('-f', '--fanout', type=int, default=20, help='Distinct directory names per level (default: 20)')
+@option('-n', '--num-keys', 'nums', default='10k,1m,10m', help='Comma-separated listing sizes (default: "10k,1m,10m")')
+def main(max_depth, fanout, nums):
+    for n in map(parse_num, nums.split(',')):
+        files = synthetic_files(n, fanout=fanout, max_depth=max_depth)
+        start = perf_counter()
+        aggd = agg_dirs(files)
+        elapsed = perf_counter() - start
+        num_dirs = (aggd['type'] == 'dir').sum()
+        # ru_maxrss is KiB on Linux
+        max_rss_mb = getrusage(RUSAGE_SELF).ru_maxrss / 1024
+        print(f"{n:>11,} keys → {num_dirs:>9,} dirs: {elapsed:8.2f}s ({n / elapsed:,.0f} keys/s), max RSS {max_rss_mb:,.0f}MiB")
+        del files, aggd
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "moto[s3]",
+#     "numpy",
+#     "pandas>=2.3",
+#     "pyarrow",
+#     "utz",
+# ]
+# ///
+"""Check `s3-usage.py`'s incremental SQLite and Parquet stores against an in-process moto S3: a full scan, then a
+re-scan of one prefix (after adding an object under it), and of another whose objects were all deleted, must leave
+the same rows and totals as a fresh full scan (and, for SQLite, log the changes for `query diff`).
+
+The bucket includes zero-byte folder-marker objects (``a/``, ``a/z/``), whose keys equal their dir rows' keys. Also
+checks that stores in the older (pre-incremental) formats are rejected, rather than updated in place."""
+from os import environ
+from os.path import abspath, dirname, join
+from runpy import run_path
+import sqlite3
+from tempfile import TemporaryDirectory
+
+import boto3
+import pandas as pd
+from click import ClickException, command
+from moto import mock_aws
+
+s3_usage = run_path(join(dirname(dirname(abspath(__file__))), 's3-usage.py'))
+main = s3_usage['main']
+sqlite_table = s3_usage['sqlite_table']
+query_diff = s3_usage['query_diff']
+
+BUCKET = 'bkt'
+OBJECTS = { 'a/': 0, 'a/z/': 0, 'a/1': 10, 'a/z/2': 20, 'b/3': 13 }
+ADDED = { 'a/x/4': 100 }
+DELETED = [ 'b/3' ]
+
+
+def scan(url: str, output_path: str):
+    main.main([ url, '-o', output_path ], standalone_mode=False)
+
+
+def load(output_path: str) -> pd.DataFrame:
+    if output_path.endswith('.db'):
+        with sqlite3.connect(output_path) as conn:
+            df = pd.read_sql_query(f'SELECT * FROM "{sqlite_table(output_path)}"', conn)
+    else:
+        df = pd.read_parquet(output_path)
+    return df[['key', 'type', 'size', 'num_descendents']].sort_values(['key', 'type']).reset_index(drop=True)
+
+
+def check_store(tmpdir: str, ext: str):
+    incremental = join(tmpdir, f'snapshot{ext}')
+    scan(f's3://{BUCKET}', incremental)
+    put_objects(ADDED)
+    scan(f's3://{BUCKET}/a', incremental)
+    # Empty re-scan: the deleted subtree's rows are removed, and its ancestors' totals reduced
+    deleted_at = str(pd.Timestamp.now(tz='UTC'))
+    boto3.client('s3').delete_objects(Bucket=BUCKET, Delete=dict(Objects=[ dict(Key=key) for key in DELETED ]))
+    scan(f's3://{BUCKET}/b', incremental)
+    fresh = join(tmpdir, f'fresh{ext}')
+    scan(f's3://{BUCKET}', fresh)
+
+    rows = load(incremental)
+    pd.testing.assert_frame_equal(rows, load(fresh))
+    by_key = rows.set_index(['key', 'type'])
+    all_objects = { key: size for key, size in (OBJECTS | ADDED).items() if key not in DELETED }
+    assert by_key.loc[('', 'dir'), 'size'] == sum(all_objects.values()), by_key.loc[('', 'dir')]
+    assert by_key.loc[('', 'dir'), 'num_descendents'] == len(all_objects), by_key.loc[('', 'dir')]
+    for marker in [ 'a/', 'a/z/' ]:
+        assert (marker, 'dir') in by_key.index and (marker, 'file') in by_key.index, marker
+    if ext == '.db':
+        with sqlite3.connect(incremental) as conn:
+            diff = pd.DataFrame(query_diff(conn, sqlite_table(incremental), BUCKET, '', deleted_at, None))
+        diff = diff.set_index(['key', 'type'])
+        for key in DELETED:
+            assert pd.isna(diff.loc[(key, 'file'), 'new_size']), diff
+        root = diff.loc[('', 'dir')]
+        assert root['old_size'] - root['new_size'] == sum(OBJECTS[key] for key in DELETED), diff
+    print(f"{ext}: OK ({len(rows)} rows)")
+
+
+def check_old_formats(tmpdir: str):
+    old_db = join(tmpdir, 'old.db')
+    with sqlite3.connect(old_db) as conn:
+        pd.DataFrame(dict(bucket=[BUCKET], key=['/a'], type=['dir'], size=[10])).to_sql('old', conn)
+    old_pqt = join(tmpdir, 'old.parquet')
+    pd.DataFrame(dict(bucket=[BUCKET], key=['/a'], type=['dir'], size=[10])).to_parquet(old_pqt)
+    for path in [ old_db, old_pqt ]:
+        try:
+            scan(f's3://{BUCKET}', path)
+        except ClickException as e:
+            print(f"{path}: rejected ({e.message})")
+        else:
+            raise AssertionError(f"{path}: old format was updated in place")
+
+
+def put_objects(objects: dict[str, int]):
+    client = boto3.client('s3')
+    for key, size in objects.items():
+        client.put_object(Bucket=BUCKET, Key=key, Body=b'x' * size)
+
+
+@command
+def check():
+    environ.update(AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing', AWS_DEFAULT_REGION='us-east-1')
+    for ext in [ '.db', '.parquet' ]:
+        with mock_aws(), TemporaryDirectory() as tmpdir:
+            boto3.client('s3').create_bucket(Bucket=BUCKET)
+            put_objects(OBJECTS)
+            check_store(tmpdir, ext)
+    with mock_aws(), TemporaryDirectory() as tmpdir:
+        boto3.client('s3').create_bucket(Bucket=BUCKET)
+        put_objects(OBJECTS)
+        check_old_formats(tmpdir)
+
+
+if __name__ == '__main__':
+    check()
@@ -0,0 +1,72 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "pandas>=2.3",
+#     "pyarrow",
+#     "utz",
+# ]
+# ///
+"""Time `s3-usage.py`'s sharded `list_objects` at various thread counts, e.g. against a local MinIO or moto server
+(moto checks correctness, but is CPU-bound, so speedups only show against MinIO or S3):
+
+    moto_server -p 5000 &
+    bench/s3-usage-list.py -e http://localhost:5000 -P 20000 s3://bench/data
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, join
+from re import fullmatch
+from runpy import run_path
+from time import perf_counter
+
+from click import argument, command, option
+
+s3_usage = run_path(join(dirname(dirname(abspath(__file__))), 's3-usage.py'))
+list_objects = s3_usage['list_objects']
+s3_client = s3_usage['s3_client']
+
+
+def populate_bucket(client, bucket: str, prefix: str, n: int, fanout: int):
+    """Create ``bucket`` (if necessary), and ``n`` empty objects under ``prefix``, spread over a 2-level tree."""
+    try:
+        client.create_bucket(Bucket=bucket)
+    except client.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    def put(i):
+        client.put_object(Bucket=bucket, Key=f'{prefix}d{i % fanout}/e{i // fanout % fanout}/f{i}', Body=b'')
+
+    with ThreadPoolExecutor(32) as pool:
+        list(pool.map(put, range(n)))
+
+
+@command
+@option('-e', '--endpoint-url', help='S3 endpoint URL (e.g. MinIO or moto server)')
+@option('-f', '--fanout', type=int, default=32, help='Directory fanout used by -P (default: 32)')
+@option('-j', '--jobs', 'jobs_list', default='1,4,16,64', help='Comma-separated thread counts to time (default: "1,4,16,64")')
+@option('-P', '--populate', type=int, help='First create this many objects under the given prefix')
+@argument('url')
+def main(endpoint_url, fanout, jobs_list, populate, url):
+    m = fullmatch('s3://(?P<bucket>[^/]+)(?:/(?P<prefix>.*))?', url)
+    if not m:
+        raise ValueError(f'Unrecognized S3 URL: {url}')
+    bucket = m['bucket']
+    prefix = f"{m['prefix'].rstrip('/')}/" if m['prefix'] else ''
+    jobs_list = [ int(j) for j in jobs_list.split(',') ]
+    client = s3_client(jobs=max(jobs_list), endpoint_url=endpoint_url)
+    if populate:
+        populate_bucket(client, bucket, prefix, populate, fanout)
+
+    base = None
+    for jobs in jobs_list:
+        start = perf_counter()
+        files = list_objects(client, bucket, prefix, jobs=jobs)
+        elapsed = perf_counter() - start
+        base = base or elapsed
+        print(f"{jobs:>3} jobs: {len(files):,} objects in {elapsed:.2f}s ({len(files) / elapsed:,.0f}/s, {base / elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
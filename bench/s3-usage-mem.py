@@ -0,0 +1,115 @@
+#!/usr/bin/env -S uv run --script
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "boto3",
+#     "click",
+#     "numpy",
+#     "pandas>=2.3",
+#     "pyarrow",
+#     "utz",
+# ]
+# ///
+"""Measure bytes per object of `s3-usage.py`'s listing ingest, on synthetic `ListObjectsV2` pages: the previous
+row-tuple ingest ("rows") vs. the compact columnar one (`page_columns` / `concat_chunks`, "compact").
+
+Each measurement runs in a fresh process: "peak" is its max RSS growth while ingesting, "retained" is the resulting
+DataFrame's `memory_usage(deep=True)`."""
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from os.path import abspath, dirname, join
+from resource import getrusage, RUSAGE_SELF
+from runpy import run_path
+import sys
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+from click import command, option
+from utz import to_dt
+
+# Add current directory to path for local imports
+sys.path.insert(0, dirname(abspath(__file__)))
+
+from bench_utils import parse_num
+
+s3_usage = run_path(join(dirname(dirname(abspath(__file__))), 's3-usage.py'))
+page_columns = s3_usage['page_columns']
+concat_chunks = s3_usage['concat_chunks']
+
+PAGE_SIZE = 1000
+
+
+def synthetic_pages(n: int, dir_size: int, fanout: int, max_depth: int, seed: int = 0):
+    """Yield `ListObjectsV2`-style response pages (as botocore parses them) for ``n`` keys, spread over ``n /
+    dir_size`` random directories (1 to ``max_depth`` levels deep, ``fanout`` possible names per level)."""
+    rng = np.random.default_rng(seed)
+    num_dirs = max(n // dir_size, 1)
+    depths = rng.integers(1, max_depth + 1, num_dirs)
+    comps = rng.integers(0, fanout, (num_dirs, max_depth))
+    dirs = [ '/'.join(f'd{c}' for c in comps[i, :depths[i]]) for i in range(num_dirs) ]
+    for start in range(0, n, PAGE_SIZE):
+        num = min(PAGE_SIZE, n - start)
+        dir_idxs = rng.integers(0, num_dirs, num)
+        sizes = rng.integers(0, 1 << 30, num)
+        mtimes = rng.integers(1_500_000_000, 1_700_000_000, num)
+        yield dict(Contents=[
+            dict(
+                Key=f'{dirs[dir_idxs[i]]}/part-{start + i:08d}.parquet',
+                LastModified=datetime.fromtimestamp(int(mtimes[i]), tz=timezone.utc),
+                ETag=f'"{start + i:032x}"',
+                Size=int(sizes[i]),
+                StorageClass='STANDARD',
+            )
+            for i in range(num)
+        ])
+
+
+def ingest_rows(pages) -> pd.DataFrame:
+    """The previous ingest: one ``(key, size, mtime)`` tuple per object, then an object-dtype `DataFrame`."""
+    rows = []
+    for page in pages:
+        rows += [ (obj['Key'], obj['Size'], obj['LastModified']) for obj in page.get('Contents', []) ]
+    files = pd.DataFrame(rows, columns=['key', 'size', 'mtime'])
+    files['size'] = files['size'].astype('int64')
+    files['mtime'] = to_dt(files['mtime'], utc=True)
+    return files
+
+
+def ingest_compact(pages) -> pd.DataFrame:
+    return concat_chunks([ page_columns(page, extra=False) for page in pages ], extra=False)
+
+
+INGESTS = dict(rows=ingest_rows, compact=ingest_compact)
+
+
+def measure(name: str, n: int, dir_size: int, fanout: int, max_depth: int) -> tuple[float, float, float]:
+    pages = synthetic_pages(n, dir_size=dir_size, fanout=fanout, max_depth=max_depth)
+    # ru_maxrss is KiB on Linux
+    base = getrusage(RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    files = INGESTS[name](pages)
+    elapsed = perf_counter() - start
+    peak = (getrusage(RUSAGE_SELF).ru_maxrss - base) * 1024
+    retained = files.memory_usage(deep=True).sum()
+    return peak / n, retained / n, elapsed
+
+
+@command
+@option('-d', '--max-depth', type=int, default=6, help='Maximum directory depth (default: 6)')
+@option('-D', '--dir-size', type=int, default=100, help='Mean number of objects per directory (default: 100)')
+@option('-f', '--fanout', type=int, default=20, help='Distinct directory names per level (default: 20)')
+@option('-i', '--ingests', default='rows,compact', help='Comma-separated ingest paths to measure (default: "rows,compact")')
+@option('-n', '--num-keys', 'nums', default='100k,1m', help='Comma-separated listing sizes (default: "100k,1m")')
+def main(max_depth, dir_size, fanout, ingests, nums):
+    # A fresh process per measurement, so each one's peak RSS is its own
+    ctx = get_context('spawn')
+    for n in map(parse_num, nums.split(',')):
+        for name in ingests.split(','):
+            with ctx.Pool(1) as pool:
+                peak, retained, elapsed = pool.apply(measure, (name, n, dir_size, fanout, max_depth))
+            print(f"{n:>11,} keys, {name:>7}: {peak:6,.0f} B/object peak, {retained:6,.0f} B/object retained ({elapsed:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Minimal local STS stand-in (AssumeRole / GetSessionToken, over the "query" protocol), for benchmarks.
+
+Point botocore at it with `AWS_ENDPOINT_URL_STS=<url>`.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from threading import Lock, Thread
+from time import sleep
+from urllib.parse import parse_qs
+
+RESPONSE = """<{action}Response xmlns="https://sts.amazonaws.com/doc/2011-06-15/">
+  <{action}Result>
+    <Credentials>
+      <AccessKeyId>ASIASTUB{idx:012d}</AccessKeyId>
+      <SecretAccessKey>stub-secret-{idx}</SecretAccessKey>
+      <SessionToken>stub-token-{idx}</SessionToken>
+      <Expiration>{expiration}</Expiration>
+    </Credentials>
+  </{action}Result>
+  <ResponseMetadata><RequestId>stub-{idx}</RequestId></ResponseMetadata>
+</{action}Response>
+"""
+
+
+@contextmanager
+def sts_stub(delay: float = 0, duration: int = 3600):
+    """Serve a local STS stub in a background thread; yields ``(url, calls)``, where ``calls`` counts requests by
+    action. Each request sleeps ``delay`` seconds (simulating network + MFA latency)."""
+    calls = Counter()
+    lock = Lock()
+    idxs = count()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length'])).decode()
+            action = parse_qs(body)['Action'][0]
+            with lock:
+                calls[action] += 1
+                idx = next(idxs)
+            sleep(delay)
+            expiration = (datetime.now(timezone.utc) + timedelta(seconds=duration)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            resp = RESPONSE.format(action=action, idx=idx, expiration=expiration).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/xml')
+            self.send_header('Content-Length', str(len(resp)))
+            self.end_headers()
+            self.wfile.write(resp)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}', calls
+    finally:
+        server.shutdown()
+
+
+def write_aws_home(home: str, mfa_cmd: str = 'echo 123456'):
+    """Write `~/.aws/{config,credentials,creds.yml}` under ``home``, with a "base" keypair, an "mfa" session
+    profile, and a "role" profile assumed from it."""
+    from os import makedirs
+    from os.path import join
+    aws_dir = join(home, '.aws')
+    makedirs(aws_dir, exist_ok=True)
+    mfa_arn = 'arn:aws:iam::123456789012:mfa/stub'
+    with open(join(aws_dir, 'credentials'), 'w') as f:
+        f.write("[base]\naws_access_key_id = AKIASTUBBASE\naws_secret_access_key = stub-base-secret\n")
+    with open(join(aws_dir, 'config'), 'w') as f:
+        f.write(
+            f"[profile mfa]\nsource_profile = base\nmfa_serial = {mfa_arn}\nregion = us-east-1\ncredential_process = aws-creds.py\n\n"
+            "[profile role]\nsource_profile = mfa\nrole_arn = arn:aws:iam::123456789012:role/stub\nregion = us-east-1\ncredential_process = aws-creds.py\n"
+        )
+    with open(join(aws_dir, 'creds.yml'), 'w') as f:
+        f.write(f"mfa:\n  - arn: {mfa_arn}\n    cmd: {mfa_cmd}\n")
@@ -12,19 +12,158 @@ import sys
 # Add current directory to path for local imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from itertools import takewhile
+import json
+from queue import Queue
+import sqlite3
+from textwrap import indent
+from threading import Thread
+from time import sleep, time
+
 import boto3
-from click import argument, option, group
+from botocore.config import Config
+from click import UsageError, argument, get_current_context, option, group, pass_context
 from sys import stderr
 
-from aws_utils import to_json, rgx_filter, get_page, founds
+from aws_utils import default, to_json, rgx_filter, founds, paginate, batch_get, chunks, imap, format_table, parse_since
+
+
+DEFAULT_JOBS = 8
+
+# CodeBuild's API rate limits are low; retry throttled requests (from concurrent fan-outs) with backoff
+codebuild = boto3.client('codebuild', config=Config(max_pool_connections=32, retries=dict(max_attempts=10, mode='adaptive')))
+
+# Build IDs are only unique per account / region
+DEFAULT_CACHE = os.path.join(
+    os.path.expanduser('~'), '.cache', 'aws-helpers',
+    f"codebuild.{os.environ.get('AWS_PROFILE', 'default')}.{codebuild.meta.region_name}.db",
+)
+COMPLETED_STATUSES = { 'SUCCEEDED', 'FAILED', 'FAULT', 'TIMED_OUT', 'STOPPED' }
+FAILED_STATUSES = { 'FAILED', 'FAULT', 'TIMED_OUT' }
+PHASES = [
+    'SUBMITTED', 'QUEUED', 'PROVISIONING', 'DOWNLOAD_SOURCE', 'INSTALL', 'PRE_BUILD', 'BUILD', 'POST_BUILD',
+    'UPLOAD_ARTIFACTS', 'FINALIZING', 'COMPLETED',
+]
+
+
+class BuildCache:
+    """Completed builds (which never change), in a SQLite file: each build's full JSON, plus its project, status,
+    start / end times and phase durations (for `stats`).
+
+    `sync` incrementally fetches projects' builds: only IDs listed before the newest one seen by the previous sync,
+    and builds that were still in progress then."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            'CREATE TABLE IF NOT EXISTS builds ('
+            'id TEXT PRIMARY KEY, project TEXT NOT NULL, status TEXT NOT NULL, '
+            'start REAL NOT NULL, end REAL NOT NULL, build TEXT NOT NULL);'
+            'CREATE INDEX IF NOT EXISTS builds_project_start ON builds (project, start);'
+            'CREATE TABLE IF NOT EXISTS phases ('
+            'id TEXT NOT NULL, phase TEXT NOT NULL, duration REAL NOT NULL, PRIMARY KEY (id, phase));'
+            'CREATE TABLE IF NOT EXISTS synced ('
+            'project TEXT PRIMARY KEY, last_id TEXT, synced_at REAL NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS pending (id TEXT PRIMARY KEY, project TEXT NOT NULL);'
+        )
+
+    def put(self, build):
+        """Store `build` if it's completed; return whether it was."""
+        if build['buildStatus'] not in COMPLETED_STATUSES:
+            return False
+        self.conn.execute(
+            'INSERT OR REPLACE INTO builds (id, project, status, start, end, build) VALUES (?, ?, ?, ?, ?, ?)',
+            (
+                build['id'], build['projectName'], build['buildStatus'],
+                build['startTime'].timestamp(), build.get('endTime', build['startTime']).timestamp(), json.dumps(build, default=default),
+            ),
+        )
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO phases (id, phase, duration) VALUES (?, ?, ?)',
+            [
+                (build['id'], phase['phaseType'], phase['durationInSeconds'])
+                for phase in build.get('phases', [])
+                if 'durationInSeconds' in phase
+            ],
+        )
+        self.conn.execute('DELETE FROM pending WHERE id = ?', (build['id'],))
+        return True
+
+    def get_builds(self, build_ids, jobs=DEFAULT_JOBS):
+        """Yield builds for `build_ids` (in order): completed ones from the cache, the rest via `batch_get_builds`
+        (storing any that have since completed). Cached builds' timestamps are ISO strings (as `to_json` prints them)."""
+        build_ids = list(build_ids)
+        cached = {}
+        for batch in chunks(build_ids, 500):
+            cached.update(self.conn.execute(
+                f'SELECT id, build FROM builds WHERE id IN ({", ".join("?" * len(batch))})', batch,
+            ))
+        missing = [ id for id in build_ids if id not in cached ]
+        fetched = { build['id']: build for build in batch_get(codebuild.batch_get_builds, missing, 'builds', item_key='id', jobs=jobs) }
+        for build in fetched.values():
+            self.put(build)
+        self.conn.commit()
+        for id in build_ids:
+            yield json.loads(cached[id]) if id in cached else fetched[id]
+
+    def sync(self, project_names, jobs=DEFAULT_JOBS):
+        """Fetch and store `project_names`' builds started since the last sync (and completions of builds pending
+        then), listing projects concurrently; return the number of builds stored."""
+        last_ids = dict(self.conn.execute('SELECT project, last_id FROM synced'))
+
+        def new_build_ids(project_name):
+            # Listed newest first; stop at the newest build seen last time
+            build_ids = paginate(codebuild, 'list_builds_for_project', 'ids', projectName=project_name, sortOrder='DESCENDING')
+            return list(takewhile(lambda id: id != last_ids.get(project_name), build_ids))
+
+        new_ids = dict(zip(project_names, imap(new_build_ids, project_names, jobs=jobs)))
+        pending = [ id for id, project in self.conn.execute('SELECT id, project FROM pending') if project in new_ids ]
+        build_ids = [ id for ids in new_ids.values() for id in ids ] + pending
+        num = 0
+        for build in batch_get(codebuild.batch_get_builds, build_ids, 'builds', item_key='id', jobs=jobs):
+            if self.put(build):
+                num += 1
+            else:
+                self.conn.execute('INSERT OR IGNORE INTO pending (id, project) VALUES (?, ?)', (build['id'], build['projectName']))
+        now = time()
+        self.conn.executemany(
+            'INSERT INTO synced (project, last_id, synced_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (project) DO UPDATE SET last_id = coalesce(excluded.last_id, last_id), synced_at = excluded.synced_at',
+            [ (project_name, ids[0] if ids else None, now) for project_name, ids in new_ids.items() ],
+        )
+        self.conn.commit()
+        return num
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
 
+@group('codebuild')
+@option('-c', '--cache', 'cache_path', envvar='CODEBUILD_CACHE', default=DEFAULT_CACHE, show_default=True, help='SQLite cache of completed builds (used by `builds list -v`, `projects builds -v`, and `stats`)')
+@option('-C', '--no-cache', is_flag=True, help="Don't read or write the build cache")
+@pass_context
+def main(ctx, cache_path, no_cache):
+    ctx.obj = dict(cache_path=None if no_cache else cache_path, cache=None)
 
-codebuild = boto3.client('codebuild')
 
+def open_cache():
+    """The build cache (opened on first use, and closed with the CLI's context), or `None` with -C/--no-cache."""
+    ctx = get_current_context().find_root()
+    if ctx.obj['cache'] is None and ctx.obj['cache_path']:
+        ctx.obj['cache'] = BuildCache(ctx.obj['cache_path'])
+        ctx.call_on_close(ctx.obj['cache'].close)
+    return ctx.obj['cache']
 
-@group('codebuild')
-def main():
-    pass
+
+def get_builds(build_ids, jobs=DEFAULT_JOBS):
+    cache = open_cache()
+    if cache:
+        return cache.get_builds(build_ids, jobs=jobs)
+    return batch_get(codebuild.batch_get_builds, build_ids, 'builds', item_key='id', jobs=jobs)
 
 
 @main.group('projects')
@@ -36,14 +175,14 @@ def projects(): pass
 @option('-f', '--fullmatch', required=False, is_flag=True, help='Use re.fullmatch instead of re.search when matching <regex> argument(s)')
 @argument('regexs', required=False, nargs=-1)
 def projects_list(verbose, fullmatch, regexs):
-    all_project_names = codebuild.list_projects()['projects']
+    all_project_names = list(paginate(codebuild, 'list_projects', 'projects'))
     project_names = rgx_filter(all_project_names, fullmatch=fullmatch, regexs=regexs)
     if not project_names:
         return
         # raise RuntimeError(f'No projects found matching {regexs}')
 
     if verbose:
-        projects = founds(codebuild.batch_get_projects(names=project_names), 'projects')
+        projects = list(batch_get(codebuild.batch_get_projects, project_names, 'projects', ids_key='names', item_key='name'))
         print(to_json(projects))
     else:
         print('\n'.join(project_names))
@@ -60,10 +199,8 @@ def get_build_summaries(builds):
 
 
 def get_builds_for_project(verbose, max_num, project_name):
-    build_ids = get_page(codebuild, 'list_builds_for_project', max_num, projectName=project_name)['ids']
-    if not build_ids:
-        return []
-    builds = founds(codebuild.batch_get_builds(ids=build_ids), 'builds')
+    build_ids = paginate(codebuild, 'list_builds_for_project', 'ids', max_num, projectName=project_name)
+    builds = list(get_builds(build_ids))
     if not verbose:
         builds = get_build_summaries(builds)
     return builds
@@ -74,11 +211,12 @@ def get_builds_for_project(verbose, max_num, project_name):
 @option('-n', '--max-num', type=int, help='Maximum number of builds to list')
 @argument('project_name')
 def project_builds(verbose, max_num, project_name):
-    builds = get_builds_for_project(verbose=verbose == 2, max_num=max_num, project_name=project_name)
     if verbose:
+        builds = get_builds_for_project(verbose=verbose == 2, max_num=max_num, project_name=project_name)
         print(to_json(builds))
     else:
-        ids = [ build['id'] for build in builds ]
+        # IDs only; no need to fetch the builds
+        ids = paginate(codebuild, 'list_builds_for_project', 'ids', max_num, projectName=project_name)
         print('\n'.join(ids))
 
 
@@ -91,14 +229,14 @@ def builds(): pass
 @option('-f', '--fullmatch', required=False, is_flag=True, help='Use re.fullmatch instead of re.search when matching <regex> argument(s)')
 @argument('regexs', required=False, nargs=-1)
 def builds_list(verbose, fullmatch, regexs):
-    all_build_ids = codebuild.list_builds()['ids']
+    all_build_ids = list(paginate(codebuild, 'list_builds', 'ids'))
     build_ids = rgx_filter(all_build_ids, fullmatch=fullmatch, regexs=regexs)
     if not build_ids:
         return
         # raise RuntimeError(f'No projects found matching {regexs}')
 
     if verbose:
-        builds = founds(codebuild.batch_get_builds(ids=build_ids), 'builds')
+        builds = list(get_builds(build_ids))
         if verbose == 1:
             build_summaries = get_build_summaries(builds)
             print(to_json(build_summaries))
@@ -108,67 +246,343 @@ def builds_list(verbose, fullmatch, regexs):
         print('\n'.join(build_ids))
 
 
+def latest_builds(project_names, jobs=DEFAULT_JOBS):
+    """Map each of `project_names` to its latest build (or `None`, if it has none).
+
+    The latest build IDs are listed concurrently (`jobs` `list_builds_for_project` calls at a time), then resolved
+    with 100-ID `batch_get_builds` calls."""
+    def latest_build_id(project_name):
+        return next(paginate(codebuild, 'list_builds_for_project', 'ids', 1, projectName=project_name), None)
+
+    build_ids = dict(zip(project_names, imap(latest_build_id, project_names, jobs=jobs)))
+    builds = batch_get(codebuild.batch_get_builds, [ id for id in build_ids.values() if id ], 'builds', item_key='id', jobs=jobs)
+    builds = { build['id']: build for build in builds }
+    return { project_name: builds.get(build_id) for project_name, build_id in build_ids.items() }
+
+
 @builds.command('latest')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of projects to query concurrently (default: {DEFAULT_JOBS})')
 @option('-v', '--verbose', count=True, help='0 (default): print build IDs only; 1 ("-v"): print {id, startTime, buildStatus}; 2 ("-vv"): print full build objects')
 @argument('project_names', nargs=-1)
-def latest(verbose, project_names):
-    builds_dict = {}
-    for project_name in project_names:
-        project_builds = get_builds_for_project(verbose=verbose == 2, max_num=1, project_name=project_name)
-        if len(project_builds) == 1:
-            builds_dict[project_name] = project_builds[0]
-        elif not project_builds:
-            builds_dict[project_name] = None
-        else:
-            raise RuntimeError("Found %d builds for project %s: %s" % (len(project_builds), project_name, str(project_builds)))
-
+def latest(jobs, verbose, project_names):
+    builds_dict = latest_builds(project_names, jobs=jobs)
     if verbose:
+        if verbose == 1:
+            builds_dict = {
+                project_name: get_build_summaries([ build ])[0] if build else None
+                for project_name, build in builds_dict.items()
+            }
         print(to_json(builds_dict))
     else:
-        ids = [ build['id'] for build in builds_dict.values() ]
+        ids = [ build['id'] for build in builds_dict.values() if build ]
         print('\n'.join(ids))
 
 
-@builds.command('logs')
-@option('-e', '--event-json', is_flag=True, help='Print a JSON array with the full events ({datetime, level, message}) rather than just printing the messages (which is the default behavior)')
-@option('-n', '--max-num', type=int, default='-1', help='Only fetch this many events; -1 (default) means "no limit" / "fetch all"')
-@option('-s', '--page-size', type=int, default='10000', help='Only fetch this many events; -1 (default) means "no limit" / "fetch all"')
-@argument('id')
-def logs(event_json, max_num, page_size, id):
-    [build] = founds(codebuild.batch_get_builds(ids=[id]), 'builds')
-    logs = build['logs']
-    log_group = logs['groupName']
-    log_stream = logs['streamName']
+def fmt_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f'{hours}h{minutes:02d}m{seconds:02d}s'
+    if minutes:
+        return f'{minutes}m{seconds:02d}s'
+    return f'{seconds}s'
+
+
+def dashboard_table(builds_dict):
+    """Status table (and a summary line of status counts) for `latest_builds` output."""
+    now = datetime.now(timezone.utc)
+    rows = []
+    statuses = Counter()
+    for project_name, build in builds_dict.items():
+        if not build:
+            rows.append([ project_name, '-', '-', '-', '-' ])
+            continue
+        status = build['buildStatus']
+        statuses[status] += 1
+        if status == 'IN_PROGRESS':
+            status = f"{status} ({build.get('currentPhase', '?')})"
+        start = build['startTime']
+        duration = (build.get('endTime') or now) - start
+        rows.append([
+            project_name,
+            status,
+            start.astimezone().strftime('%Y-%m-%d %H:%M:%S'),
+            fmt_duration(duration.total_seconds()),
+            build['id'],
+        ])
+    summary = ', '.join(f'{num} {status}' for status, num in statuses.most_common())
+    table = format_table(rows, [ 'PROJECT', 'STATUS', 'STARTED', 'DURATION', 'BUILD' ])
+    return f'{now.astimezone():%Y-%m-%d %H:%M:%S}: {len(builds_dict)} projects ({summary or "no builds"})\n\n{table}'
+
+
+@builds.command('dashboard')
+@option('-f', '--fullmatch', required=False, is_flag=True, help='Use re.fullmatch instead of re.search when matching <regex> argument(s)')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of projects to query concurrently (default: {DEFAULT_JOBS})')
+@option('-w', '--watch', 'interval', type=float, help='Refresh every this many seconds, until interrupted')
+@argument('regexs', required=False, nargs=-1)
+def dashboard(fullmatch, jobs, interval, regexs):
+    """Print each project's latest build's status and duration (for all projects, or those matching <regexs>)."""
+    all_project_names = list(paginate(codebuild, 'list_projects', 'projects'))
+    project_names = rgx_filter(all_project_names, fullmatch=fullmatch, regexs=regexs)
+    try:
+        while True:
+            table = dashboard_table(latest_builds(project_names, jobs=jobs))
+            if interval is None:
+                print(table)
+                return
+            # Clear the screen (when interactive) before redrawing
+            print(('\033[H\033[2J' if sys.stdout.isatty() else '\n') + table, flush=True)
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+FOLLOW_MIN_DELAY = 1
+FOLLOW_MAX_DELAY = 30
+
+
+def get_build(build_id):
+    [build] = founds(codebuild.batch_get_builds(ids=[build_id]), 'builds')
+    return build
+
+
+def get_log_pages(logs_client, group, stream, state, page_size):
+    """Yield `get_log_events` pages from `state['token']` on, until caught up; `state['token']` is set to the token
+    following each page before it's yielded."""
+    token = state.get('token')
+    while True:
+        kwargs = dict(logGroupName=group, logStreamName=stream, limit=page_size, startFromHead=True)
+        if token:
+            kwargs['nextToken'] = token
+        resp = logs_client.get_log_events(**kwargs)
+        state['token'] = resp['nextForwardToken']
+        yield resp['events']
+        if resp['nextForwardToken'] == token:
+            return
+        token = resp['nextForwardToken']
+
+
+def filter_log_pages(logs_client, group, stream, state, page_size, grep):
+    """Yield `filter_log_events` pages (events matching `grep`, if given) from `state['since']` on, until caught up.
+
+    `filter_log_events` tokens don't outlive a query, so `state` records the last event's timestamp (`since`), and the
+    IDs of the events seen at it (`seen`), which the next (`--follow`) query starts from, and skips."""
+    kwargs = dict(logGroupName=group, logStreamNames=[stream], limit=page_size)
+    if grep:
+        kwargs['filterPattern'] = grep
+    if state.get('since'):
+        kwargs['startTime'] = state['since']
+    seen = state.setdefault('seen', set())
+    while True:
+        resp = logs_client.filter_log_events(**kwargs)
+        events = [ event for event in resp['events'] if event['eventId'] not in seen ]
+        for event in events:
+            if event['timestamp'] != state.get('since'):
+                state['since'] = event['timestamp']
+                seen.clear()
+            seen.add(event['eventId'])
+        yield events
+        if not resp.get('nextToken'):
+            return
+        kwargs['nextToken'] = resp['nextToken']
+
+
+def log_pages(logs_client, build_id, page_size, state, since=None, grep=None, follow=False):
+    """Yield pages (lists) of `build_id`'s log events as they're fetched.
+
+    With `follow`, keep polling (backing off exponentially, up to `FOLLOW_MAX_DELAY` seconds, while no new events
+    arrive) until the build is no longer `IN_PROGRESS`, then fetch any remaining events. `since` / `grep` select
+    events via `filter_log_events`; otherwise `get_log_events` pages are fetched from `state['token']` (a
+    `nextForwardToken`, e.g. from an interrupted run) on."""
+    if since:
+        state['since'] = int(since.timestamp() * 1000)
+    delay = FOLLOW_MIN_DELAY
+    while True:
+        build = get_build(build_id)
+        logs = build.get('logs', {})
+        group, stream = logs.get('groupName'), logs.get('streamName')
+        num = 0
+        if group and stream:
+            if since or grep:
+                pages = filter_log_pages(logs_client, group, stream, state, page_size, grep)
+            else:
+                pages = get_log_pages(logs_client, group, stream, state, page_size)
+            try:
+                for page in pages:
+                    num += len(page)
+                    yield page
+            except logs_client.exceptions.ResourceNotFoundException:
+                # Build hasn't started logging yet
+                if not follow:
+                    raise
+        if not follow or build['buildStatus'] != 'IN_PROGRESS':
+            return
+        delay = FOLLOW_MIN_DELAY if num else min(delay * 2, FOLLOW_MAX_DELAY)
+        sleep(delay)
+
+
+def stream_builds_logs(build_ids, max_num, token=None, **kwargs):
+    """Yield `(build_id, page, token)`s (or `(build_id, exception, None)`) from each of `build_ids`' `log_pages`,
+    fetched concurrently (one thread per build), in the order they arrive. `page`s are truncated to `max_num` events
+    per build (if not -1); `token` is the `nextForwardToken` following each `page` (if any)."""
     logs_client = boto3.client('logs')
-    events = []
-    next_token = None
-    page_idx = 1
-    while max_num == -1 or len(events) < max_num:
-        if max_num == -1:
-            limit = page_size
+    pages = Queue(maxsize=2 * len(build_ids))
+
+    def fetch(build_id):
+        state = dict(token=token)
+        num = 0
+        try:
+            for page in log_pages(logs_client, build_id, state=state, **kwargs):
+                if max_num != -1:
+                    page = page[:max_num - num]
+                num += len(page)
+                if page:
+                    pages.put((build_id, page, state.get('token')))
+                if num == max_num:
+                    break
+        except Exception as e:
+            pages.put((build_id, e, None))
+        pages.put((build_id, None, None))
+
+    for build_id in build_ids:
+        Thread(target=fetch, args=(build_id,), daemon=True).start()
+    remaining = len(build_ids)
+    while remaining:
+        build_id, page, token = pages.get()
+        if page is None:
+            remaining -= 1
         else:
-            limit = min(max_num - len(events), page_size)
-        kwargs = dict(logGroupName=log_group, logStreamName=log_stream, limit=limit, startFromHead=True)
-        if next_token:
-            kwargs['nextToken'] = next_token
+            yield build_id, page, token
 
-        stderr.write(f'Fetching page {page_idx} (currently {len(events)} events), size {page_size}, limit {limit}, token {next_token}, group {log_group}, stream {log_stream}\n')
-        resp = logs_client.get_log_events(**kwargs)
-        page_idx += 1
 
-        new_events = resp['events']
-        stderr.write(f'got {len(new_events)} new events\n')
-        events += new_events
+@builds.command('logs')
+@option('-e', '--event-json', is_flag=True, help='Print a JSON array with the full events ({timestamp, message, ingestionTime, ...}) rather than just printing the messages (which is the default behavior)')
+@option('-F', '--follow', is_flag=True, help=f'Keep polling for new events while the build(s) are IN_PROGRESS (backing off up to {FOLLOW_MAX_DELAY}s between polls)')
+@option('-g', '--grep', help='Only print events matching this CloudWatch Logs filter pattern (via `filter_log_events`)')
+@option('-n', '--max-num', type=int, default='-1', help='Only fetch this many events (per build); -1 (default) means "no limit" / "fetch all"')
+@option('-S', '--since', help='Only print events since this time (ISO 8601, or a duration ago like "30m", "2h", "1d")')
+@option('-s', '--page-size', type=int, default='10000', help='Fetch this many events per request (default: 10000)')
+@option('-t', '--token', help='Resume from this `nextForwardToken` (printed to stderr on interrupt); single build, without -S/-g')
+@argument('ids', nargs=-1, required=True)
+def logs(event_json, follow, grep, max_num, since, page_size, token, ids):
+    """Print build(s)' logs as they're fetched.
+
+    With multiple IDs, their logs are fetched concurrently, and printed interleaved, each line (or event) prefixed
+    with (or tagged with) its build ID."""
+    if token and (len(ids) > 1 or since or grep):
+        raise UsageError('-t/--token requires a single build, without -S/--since or -g/--grep')
+    since = parse_since(since) if since else None
+    prefix = len(ids) > 1
+    first = True
+    errors = 0
+    if event_json:
+        print('[')
+    try:
+        for build_id, page, token in stream_builds_logs(
+            ids, max_num, token=token, page_size=page_size, since=since, grep=grep, follow=follow,
+        ):
+            if isinstance(page, Exception):
+                stderr.write(f'{build_id}: {page}\n')
+                errors += 1
+                continue
+            if event_json:
+                for event in page:
+                    if prefix:
+                        event = dict(buildId=build_id, **event)
+                    print(('' if first else ',\n') + indent(to_json(event), '    '), end='')
+                    first = False
+            else:
+                lines = [ event['message'].rstrip('\n') for event in page ]
+                if prefix:
+                    lines = [ f'{build_id}: {line}' for line in lines ]
+                print('\n'.join(lines))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        if token and not prefix:
+            stderr.write(f'Interrupted; resume with: -t {token}\n')
+        errors += 1
+    finally:
+        if event_json:
+            print('\n]')
+    if errors:
+        sys.exit(1)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted `values`."""
+    return values[max(round(pct / 100 * len(values)) - 1, 0)]
+
+
+def build_stats(conn, project_names, since):
+    """Per-project build stats (count, failures, p50 / p95 duration), and phase stats (count, p50 / p95, and share of
+    total build time, per phase type), for builds started since `since`."""
+    placeholders = ', '.join('?' * len(project_names))
+    params = [ *project_names, since.timestamp() ]
+    durations = defaultdict(list)
+    failures = Counter()
+    for project, status, duration in conn.execute(
+        f'SELECT project, status, end - start FROM builds WHERE project IN ({placeholders}) AND start >= ? ORDER BY 3',
+        params,
+    ):
+        durations[project].append(duration)
+        failures[project] += status in FAILED_STATUSES
+    phase_durations = defaultdict(list)
+    for project, phase, duration in conn.execute(
+        f'SELECT b.project, p.phase, p.duration FROM phases p JOIN builds b USING (id) '
+        f'WHERE b.project IN ({placeholders}) AND b.start >= ? ORDER BY 3',
+        params,
+    ):
+        phase_durations[project, phase].append(duration)
+
+    projects = [
+        [
+            project, len(ds), failures[project], f'{failures[project] / len(ds):.0%}',
+            fmt_duration(percentile(ds, 50)), fmt_duration(percentile(ds, 95)),
+        ]
+        for project, ds in sorted(durations.items())
+    ]
+    phases = [
+        [
+            project, phase, len(ds), fmt_duration(percentile(ds, 50)), fmt_duration(percentile(ds, 95)),
+            f'{sum(ds) / sum(durations[project]):.0%}' if sum(durations[project]) else '-',
+        ]
+        for (project, phase), ds in sorted(
+            phase_durations.items(),
+            key=lambda item: (item[0][0], PHASES.index(item[0][1]) if item[0][1] in PHASES else len(PHASES), item[0][1]),
+        )
+    ]
+    return projects, phases
 
-        if resp['nextForwardToken'] == next_token:
-            break
-        next_token = resp['nextForwardToken']
 
-    if event_json:
-        print(to_json(events))
+@main.command('stats')
+@option('-f', '--fullmatch', required=False, is_flag=True, help='Use re.fullmatch instead of re.search when matching <regex> argument(s)')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of projects to sync concurrently (default: {DEFAULT_JOBS})')
+@option('-p', '--phases', is_flag=True, help='Also print per-phase timings for each project')
+@option('-S', '--since', default='30d', help='Only include builds started since this time (ISO 8601, or a duration ago like "2h", "7d"; default: "30d")')
+@option('-s', '--sync', is_flag=True, help='Incrementally sync the matching projects\' builds into the cache first (otherwise, stats only reflect previous syncs / lookups)')
+@argument('regexs', required=False, nargs=-1)
+def stats(fullmatch, jobs, phases, since, sync, regexs):
+    """Build duration percentiles, failure rates, and phase timings per project, from the build cache."""
+    cache = open_cache()
+    if not cache:
+        raise UsageError('stats requires the build cache (not -C/--no-cache)')
+    if sync:
+        all_project_names = list(paginate(codebuild, 'list_projects', 'projects'))
     else:
-        messages = [ event['message'].rstrip('\n') for event in events ]
-        print('\n'.join(messages))
+        all_project_names = [ project for [project] in cache.conn.execute('SELECT DISTINCT project FROM builds') ]
+    project_names = rgx_filter(all_project_names, fullmatch=fullmatch, regexs=regexs)
+    if not project_names:
+        return
+    if sync:
+        num = cache.sync(project_names, jobs=jobs)
+        stderr.write(f'Synced {num} new completed builds from {len(project_names)} projects\n')
+
+    project_rows, phase_rows = build_stats(cache.conn, project_names, parse_since(since))
+    print(format_table(project_rows, [ 'PROJECT', 'BUILDS', 'FAILED', 'FAIL%', 'P50', 'P95' ]))
+    if phases:
+        print()
+        print(format_table(phase_rows, [ 'PROJECT', 'PHASE', 'BUILDS', 'P50', 'P95', 'SHARE' ]))
 
 
 if __name__ == '__main__':
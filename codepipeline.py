@@ -12,10 +12,29 @@ import sys
 # Add current directory to path for local imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from datetime import datetime
+import json
+import sqlite3
+from sys import exit
+from time import sleep
+
 import boto3
-from click import group, argument, option
+from botocore.config import Config
+from click import ClickException, group, argument, option
+
+from aws_utils import default, to_json, rgx_filter, paginate, imap
+
 
-from aws_utils import to_json, rgx_filter
+DEFAULT_JOBS = 8
+DEFAULT_CACHE = os.path.join(
+    os.path.expanduser('~'), '.cache', 'aws-helpers',
+    f"codepipeline.{os.environ.get('AWS_PROFILE', 'default')}.{boto3.session.Session().region_name}.db",
+)
+WATCH_MIN_INTERVAL = 2
+WATCH_MAX_INTERVAL = 30
+WATCH_BACKOFF = 1.5
+# `Stopping` executions may still have actions finishing
+ACTIVE_STATUSES = { 'InProgress', 'Stopping' }
 
 
 @group('codepipeline')
@@ -23,19 +42,68 @@ def codepipeline():
     pass
 
 
+class PipelineCache:
+    """Pipeline definitions, in a SQLite file, keyed by name and `updated` time (from `list_pipelines`): a pipeline
+    whose `updated` time is unchanged needn't be fetched again."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS pipelines (name TEXT PRIMARY KEY, updated TEXT NOT NULL, pipeline TEXT NOT NULL)'
+        )
+
+    def get(self, summary):
+        row = self.conn.execute(
+            'SELECT pipeline FROM pipelines WHERE name = ? AND updated = ?',
+            (summary['name'], summary['updated'].isoformat()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, summary, pipeline):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO pipelines (name, updated, pipeline) VALUES (?, ?, ?)',
+            (summary['name'], summary['updated'].isoformat(), json.dumps(pipeline, default=default)),
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def get_pipelines(client, summaries, jobs=DEFAULT_JOBS, cache=None):
+    """`get_pipeline` for each of `summaries` (from `list_pipelines`), `jobs` at a time, in order; pipelines found in
+    `cache` (at their current `updated` time) aren't fetched, and fetched ones are stored there."""
+    cached = [ cache.get(summary) if cache else None for summary in summaries ]
+    missing = [ summary for summary, pipeline in zip(summaries, cached) if pipeline is None ]
+    fetched = imap(lambda summary: client.get_pipeline(name=summary['name'])['pipeline'], missing, jobs=jobs)
+    fetched = dict(zip([ summary['name'] for summary in missing ], fetched))
+    if cache:
+        for summary in missing:
+            cache.put(summary, fetched[summary['name']])
+    return [
+        pipeline if pipeline is not None else fetched[summary['name']]
+        for summary, pipeline in zip(summaries, cached)
+    ]
+
+
 @codepipeline.command('list')
+@option('-c', '--cache', 'use_cache', is_flag=True, help=f'With -v: cache pipeline definitions (keyed by name and `updated` time) in $CODEPIPELINE_CACHE (default: {DEFAULT_CACHE}), and only fetch new / updated ones')
 @option('-f', '--fullmatch', required=False, is_flag=True, help='Use re.fullmatch instead of re.search when matching <regex> argument(s)')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of concurrent `get_pipeline` calls, with -v (default: {DEFAULT_JOBS})')
 @option('-v', '--verbose', required=False, is_flag=True, help='Print pipeline details')
 @argument('regexs', required=False, nargs=-1)
-def list(fullmatch, verbose, regexs):
-    client = boto3.client('codepipeline')
-    all_pipelines = client.list_pipelines()['pipelines']
+def list_pipelines(use_cache, fullmatch, jobs, verbose, regexs):
+    client = boto3.client('codepipeline', config=Config(max_pool_connections=max(jobs, 10), retries=dict(mode='adaptive')))
+    all_pipelines = list(paginate(client, 'list_pipelines', 'pipelines'))
     pipelines = rgx_filter(all_pipelines, fullmatch=fullmatch, regexs=regexs, key='name')
     if verbose:
-        pipelines = [
-            client.get_pipeline(name=pipeline['name'])['pipeline']
-            for pipeline in pipelines
-        ]
+        cache = PipelineCache(os.environ.get('CODEPIPELINE_CACHE', DEFAULT_CACHE)) if use_cache else None
+        try:
+            pipelines = get_pipelines(client, pipelines, jobs=jobs, cache=cache)
+        finally:
+            if cache:
+                cache.close()
     print(to_json(pipelines))
 
 
@@ -51,11 +119,11 @@ def executions():
 def list_pipeline_executions(max_num, verbose, pipeline_name):
     client = boto3.client('codepipeline')
 
-    kwargs = dict()
-    if max_num != -1:
-        kwargs['maxResults'] = max_num
-
-    pipeline_executions = client.list_pipeline_executions(pipelineName=pipeline_name, **kwargs)['pipelineExecutionSummaries']
+    pipeline_executions = list(paginate(
+        client, 'list_pipeline_executions', 'pipelineExecutionSummaries',
+        max_num=None if max_num == -1 else max_num,
+        pipelineName=pipeline_name,
+    ))
     if verbose == 0:
         pipeline_executions = [
             pipeline_execution['pipelineExecutionId']
@@ -71,5 +139,86 @@ def list_pipeline_executions(max_num, verbose, pipeline_name):
     print(to_json(pipeline_executions))
 
 
+def parse_execution(client, spec):
+    """`PIPELINE[:EXECUTION_ID]` (default: the pipeline's latest execution) to `(pipeline_name, execution_id)`."""
+    pipeline_name, _, execution_id = spec.partition(':')
+    if not execution_id:
+        summaries = client.list_pipeline_executions(pipelineName=pipeline_name, maxResults=1)['pipelineExecutionSummaries']
+        if not summaries:
+            raise ClickException(f'Pipeline {pipeline_name} has no executions')
+        execution_id = summaries[0]['pipelineExecutionId']
+    return pipeline_name, execution_id
+
+
+def execution_transitions(state, execution_id):
+    """`{name: status}` for each stage (`"<stage>"`) and action (`"<stage>/<action>"`) of a `get_pipeline_state`
+    response that's running (or last ran) as part of `execution_id`."""
+    statuses = {}
+    for stage in state['stageStates']:
+        latest = stage.get('latestExecution', {})
+        if latest.get('pipelineExecutionId') != execution_id:
+            continue
+        statuses[stage['stageName']] = latest['status']
+        for action in stage.get('actionStates', []):
+            if 'latestExecution' in action:
+                statuses[f"{stage['stageName']}/{action['actionName']}"] = action['latestExecution']['status']
+    return statuses
+
+
+@executions.command('watch')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of executions / pipelines to poll concurrently (default: {DEFAULT_JOBS})')
+@option('-s', '--start', is_flag=True, help='Start a new execution of each PIPELINE (any EXECUTION_IDs are ignored), then watch it')
+@argument('executions', nargs=-1, required=True)
+def watch_pipeline_executions(jobs, start, executions):
+    """Watch pipeline executions until they finish, printing stage / action status transitions.
+
+    EXECUTIONS are `PIPELINE[:EXECUTION_ID]`s (default: each pipeline's latest execution). Polls (through one client,
+    with adaptive retries) every 2s, backing off to 30s while nothing changes. Exits 0 if every execution succeeded, 1
+    otherwise."""
+    client = boto3.client('codepipeline', config=Config(max_pool_connections=max(jobs, 10), retries=dict(mode='adaptive')))
+    if start:
+        executions = [
+            (spec.partition(':')[0], client.start_pipeline_execution(name=spec.partition(':')[0])['pipelineExecutionId'])
+            for spec in executions
+        ]
+    else:
+        executions = list(imap(lambda spec: parse_execution(client, spec), executions, jobs=jobs))
+
+    def log(pipeline_name, execution_id, msg):
+        print(f'{datetime.now():%H:%M:%S} {pipeline_name}:{execution_id}: {msg}', flush=True)
+
+    def get_execution(execution):
+        pipeline_name, execution_id = execution
+        return client.get_pipeline_execution(pipelineName=pipeline_name, pipelineExecutionId=execution_id)['pipelineExecution']
+
+    statuses = {}
+    seen = {}
+    interval = WATCH_MIN_INTERVAL
+    while True:
+        active = [ execution for execution in executions if statuses.get(execution, 'InProgress') in ACTIVE_STATUSES ]
+        pipeline_names = sorted({ pipeline_name for pipeline_name, _ in active })
+        states = dict(zip(pipeline_names, imap(lambda name: client.get_pipeline_state(name=name), pipeline_names, jobs=jobs)))
+        changed = False
+        for (pipeline_name, execution_id), pipeline_execution in zip(active, imap(get_execution, active, jobs=jobs)):
+            execution = (pipeline_name, execution_id)
+            for name, status in execution_transitions(states[pipeline_name], execution_id).items():
+                prev = seen.get((execution, name))
+                if prev != status:
+                    log(pipeline_name, execution_id, f'{name}: {f"{prev} → " if prev else ""}{status}')
+                    seen[execution, name] = status
+                    changed = True
+            status = pipeline_execution['status']
+            if statuses.get(execution) != status:
+                log(pipeline_name, execution_id, status)
+                statuses[execution] = status
+                changed = True
+        if all(status not in ACTIVE_STATUSES for status in statuses.values()):
+            break
+        interval = WATCH_MIN_INTERVAL if changed else min(interval * WATCH_BACKOFF, WATCH_MAX_INTERVAL)
+        sleep(interval)
+
+    exit(0 if all(status == 'Succeeded' for status in statuses.values()) else 1)
+
+
 if __name__ == '__main__':
     codepipeline()
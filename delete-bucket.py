@@ -7,38 +7,289 @@
 # ///
 
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+from os import remove, replace
+from os.path import exists
+from sys import exit
+from threading import Lock
+from time import monotonic, sleep
+
 import boto3
+from botocore.config import Config
+
+DEFAULT_JOBS = 8
+DEFAULT_BUCKET_JOBS = 4
+# S3 supports 3,500 DELETEs/s per prefix; each key in a DeleteObjects batch counts as one
+DEFAULT_MAX_DELETES_PER_SEC = 3000
+DEFAULT_POLL_INTERVAL = 3600
+BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 10
+EXPIRE_RULES = [
+    dict(
+        ID='delete-bucket-expire-all',
+        Status='Enabled',
+        Filter=dict(Prefix=''),
+        Expiration=dict(Days=1),
+        NoncurrentVersionExpiration=dict(NoncurrentDays=1),
+        AbortIncompleteMultipartUpload=dict(DaysAfterInitiation=1),
+    ),
+    # Can't be combined with `Expiration.Days` in one rule
+    dict(
+        ID='delete-bucket-expire-delete-markers',
+        Status='Enabled',
+        Filter=dict(Prefix=''),
+        Expiration=dict(ExpiredObjectDeleteMarker=True),
+    ),
+]
+
+
+class RateLimiter:
+    """Token bucket shared by all buckets' deletion batches: at most `rate` keys deleted per second, overall."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.last = monotonic()
+        self.lock = Lock()
+
+    def acquire(self, n: int):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            wait = -self.tokens / self.rate
+        # Tokens are reserved (possibly going negative) under the lock; callers sleep off their debt concurrently
+        if wait > 0:
+            sleep(wait)
+
+
+def fmt_bytes(n: float) -> str:
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if n < 1024 or unit == 'TiB':
+            break
+        n /= 1024
+    return f'{n:,.0f}{unit}' if unit == 'B' else f'{n:,.1f}{unit}'
+
+
+def markers_path(bucket: str) -> str:
+    return f'.delete-bucket.{bucket}.json'
+
+
+def load_markers(path: str) -> dict:
+    """Resume state: listing markers up to which every version has been deleted, and the running totals."""
+    if not exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_markers(path: str, markers: dict):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(markers, f)
+    replace(tmp_path, path)
+
+
+def list_pages(client, bucket: str, markers: dict):
+    """Yield `(batch, next_markers)` for each `ListObjectVersions` page: the page's versions and delete markers (as
+    `DeleteObjects` identifiers, with their sizes), and the markers from which listing would resume after it."""
+    kwargs = { k: markers[k] for k in ['KeyMarker', 'VersionIdMarker'] if markers.get(k) }
+    paginator = client.get_paginator('list_object_versions')
+    for page in paginator.paginate(Bucket=bucket, PaginationConfig=dict(PageSize=BATCH_SIZE), **kwargs):
+        batch = [
+            (dict(Key=v['Key'], VersionId=v['VersionId']), v.get('Size', 0))
+            for v in page.get('Versions', []) + page.get('DeleteMarkers', [])
+        ]
+        next_markers = dict(KeyMarker=page.get('NextKeyMarker'), VersionIdMarker=page.get('NextVersionIdMarker'))
+        yield batch, next_markers
+
+
+def delete_batch(
+    client,
+    bucket: str,
+    batch: list[tuple[dict, int]],
+    limiter: RateLimiter | None = None,
+) -> tuple[int, int, list[dict]]:
+    """Delete up to `BATCH_SIZE` versions; return the number and total size of those deleted, and any errors."""
+    if limiter:
+        limiter.acquire(len(batch))
+    sizes = { (obj['Key'], obj['VersionId']): size for obj, size in batch }
+    resp = client.delete_objects(
+        Bucket=bucket,
+        Delete=dict(Objects=[ obj for obj, _ in batch ], Quiet=False),
+    )
+    deleted = resp.get('Deleted', [])
+    num_bytes = sum(sizes.get((d['Key'], d.get('VersionId')), 0) for d in deleted)
+    return len(deleted), num_bytes, resp.get('Errors', [])
+
+
+def delete_versions(
+    client,
+    bucket: str,
+    dry_run: bool,
+    pool: ThreadPoolExecutor,
+    max_inflight: int,
+    resume: bool,
+    limiter: RateLimiter | None = None,
+) -> tuple[int, int, int]:
+    """Stream `ListObjectVersions` pages into `DeleteObjects` batches on `pool` (shared with other buckets), at most
+    `max_inflight` queued at once, and throttled by `limiter` (or, if `dry_run`, just count them), printing running
+    totals. Returns the number and total size of versions (and delete markers)
+    deleted (or found), and the number of errors.
 
-session = boto3.Session()
-s3 = session.resource(service_name='s3')
-parser = ArgumentParser()
-parser.add_argument('-N','--no-dry-run',action='store_true',help='Actually execute deletions; by default, run in "dry run" mode: print summary info about objects/versions to be deleted and exit without performing any deletions')
-parser.add_argument('bucket',nargs='+',help='Buckets to delete all objects+versions from')
-args = parser.parse_args()
-buckets = args.bucket
-dry_run = not args.no_dry_run
-if dry_run:
-    print('Running in "dry run" mode; use -N to bypass "dry run" mode and actually perform deletions')
-for bucket in buckets:
+    With `resume` (ignored if `dry_run`), the listing markers up to which every batch has completed without errors are
+    saved to `markers_path(bucket)` after each batch, and picked up from there by the next run (which so retries the
+    first batch with errors, and everything after it)."""
+    path = markers_path(bucket)
+    resume = resume and not dry_run
+    markers = load_markers(path) if resume else {}
+    if markers:
+        print(f'{bucket}: resuming from key {markers["KeyMarker"]!r} ({markers["num"]:,} versions, {fmt_bytes(markers["bytes"])} previously deleted)')
+    num = markers.get('num', 0)
+    num_bytes = markers.get('bytes', 0)
+    num_errors = 0
+    last_progress = monotonic()
+
+    def progress(force: bool = False):
+        nonlocal last_progress
+        if force or monotonic() - last_progress >= PROGRESS_INTERVAL:
+            verb = 'found' if dry_run else 'deleted'
+            print(f'{bucket}: {num:,} versions {verb} ({fmt_bytes(num_bytes)}){f", {num_errors:,} errors" if num_errors else ""}')
+            last_progress = monotonic()
+
+    if dry_run:
+        for batch, _ in list_pages(client, bucket, markers):
+            num += len(batch)
+            num_bytes += sum(size for _, size in batch)
+            progress()
+        progress(force=True)
+        return num, num_bytes, num_errors
+
+    # Batches' futures, in listing order; they're collected in that order, so the saved markers only advance past a
+    # batch once it and all earlier ones have completed (and a resumed run never skips undeleted versions)
+    pending = deque()
+
+    def drain(max_pending: int):
+        nonlocal num, num_bytes, num_errors
+        while len(pending) > max_pending or (pending and pending[0][0].done()):
+            future, next_markers = pending.popleft()
+            deleted, deleted_bytes, errors = future.result()
+            num += deleted
+            num_bytes += deleted_bytes
+            num_errors += len(errors)
+            for e in errors[:3]:
+                print(f'{bucket}: error deleting {e["Key"]} ({e.get("VersionId")}): {e["Code"]} {e["Message"]}')
+            # Once a batch has failed, stop advancing the markers, so a resumed run re-lists its versions
+            if resume and not num_errors:
+                save_markers(path, dict(**next_markers, num=num, bytes=num_bytes))
+            progress()
+
+    for batch, next_markers in list_pages(client, bucket, markers):
+        if batch:
+            pending.append((pool.submit(delete_batch, client, bucket, batch, limiter), next_markers))
+        drain(max_inflight)
+    drain(0)
+    if resume and exists(path) and not num_errors:
+        remove(path)
+    progress(force=True)
+    return num, num_bytes, num_errors
+
+
+def is_empty(client, bucket: str) -> bool:
+    resp = client.list_object_versions(Bucket=bucket, MaxKeys=1)
+    return not resp.get('Versions') and not resp.get('DeleteMarkers')
+
+
+def expire_bucket(client, bucket: str, dry_run: bool, poll_interval: int) -> bool:
+    """Install lifecycle rules expiring all current and noncurrent versions (and, afterwards, the resulting delete
+    markers) of `bucket`, then poll (every `poll_interval` seconds; once, if 0) until S3 has emptied it, and delete
+    it. Lifecycle expiration is asynchronous (typically a day or more), but costs no DELETE requests."""
+    if dry_run:
+        print(f'{bucket}: would suspend versioning, and install lifecycle rules: {", ".join(r["ID"] for r in EXPIRE_RULES)}')
+        return True
+    client.put_bucket_versioning(Bucket=bucket, VersioningConfiguration=dict(Status='Suspended'))
+    client.put_bucket_lifecycle_configuration(Bucket=bucket, LifecycleConfiguration=dict(Rules=EXPIRE_RULES))
+    print(f'{bucket}: suspended versioning, installed lifecycle rules: {", ".join(r["ID"] for r in EXPIRE_RULES)}')
+    while not is_empty(client, bucket):
+        if not poll_interval:
+            print(f'{bucket}: not empty yet; re-run later (or pass -p) to delete it once it is')
+            return False
+        print(f'{bucket}: not empty yet; checking again in {poll_interval}s')
+        sleep(poll_interval)
+    print(f'{bucket}: empty; deleting bucket…')
+    client.delete_bucket(Bucket=bucket)
+    return True
+
+
+def teardown_bucket(
+    client,
+    bucket: str,
+    dry_run: bool,
+    pool: ThreadPoolExecutor,
+    max_inflight: int,
+    resume: bool,
+    limiter: RateLimiter,
+) -> bool:
     if dry_run:
         print(f'Simulating bucket deletion: {bucket}')
-    else:
-        print(f'Deleting bucket, objects, and versions: {bucket}')
-    bucket = s3.Bucket(bucket)
-    object_versions = bucket.object_versions
-    num_object_versions = len(list(object_versions.iterator()))
-    objects = bucket.objects
-    num_objects = len(list(objects.iterator()))
+        num, num_bytes, _ = delete_versions(client, bucket, True, pool, max_inflight, resume)
+        print(f'{bucket}: would delete: {num:,} object versions ({fmt_bytes(num_bytes)})')
+        return True
+
+    print(f'Deleting bucket, objects, and versions: {bucket}')
+    client.put_bucket_versioning(Bucket=bucket, VersioningConfiguration=dict(Status='Suspended'))
+    print(f'{bucket}: suspended versioning')
+    num, num_bytes, num_errors = delete_versions(client, bucket, False, pool, max_inflight, resume, limiter)
+    print(f'{bucket}: {num:,} deleted versions ({fmt_bytes(num_bytes)})')
+    if num_errors:
+        print(f'{bucket}: {num_errors:,} versions could not be deleted; not deleting bucket')
+        return False
+    print(f'{bucket}: deleting bucket…')
+    client.delete_bucket(Bucket=bucket)
+    return True
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-b', '--bucket-jobs', type=int, default=DEFAULT_BUCKET_JOBS, help=f'Number of buckets to process concurrently (default: {DEFAULT_BUCKET_JOBS})')
+    parser.add_argument('-e', '--expire', action='store_true', help="Instead of deleting versions from the client, install lifecycle rules that expire all of them, wait for S3 to empty the bucket, and delete it (slow, but no per-object DELETE requests)")
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of concurrent DeleteObjects requests (of up to {BATCH_SIZE} versions each), across all buckets (default: {DEFAULT_JOBS})')
+    parser.add_argument('-N','--no-dry-run',action='store_true',help='Actually execute deletions; by default, run in "dry run" mode: print summary info about objects/versions to be deleted and exit without performing any deletions')
+    parser.add_argument('-p', '--poll-interval', type=int, default=DEFAULT_POLL_INTERVAL, help=f'With -e: seconds between checks for whether a bucket is empty yet; 0: check once and exit (default: {DEFAULT_POLL_INTERVAL})')
+    parser.add_argument('-r', '--resume', action='store_true', help='Save listing markers to .delete-bucket.<bucket>.json as batches complete, and resume from them (if present)')
+    parser.add_argument('-R', '--max-deletes-per-sec', type=float, default=DEFAULT_MAX_DELETES_PER_SEC, help=f'Global budget of keys deleted per second, across all buckets and requests (default: {DEFAULT_MAX_DELETES_PER_SEC})')
+    parser.add_argument('bucket',nargs='+',help='Buckets to delete all objects+versions from')
+    args = parser.parse_args()
+    buckets = args.bucket
+    dry_run = not args.no_dry_run
+    jobs = args.jobs
     if dry_run:
-        print(f'Would delete: {num_object_versions} object versions')
-    else:
-        bucket.Versioning().suspend()
-        print('Suspended versioning')
-        resp = object_versions.delete()
-        num_deleted = sum(len(p['Deleted']) for p in resp)
-        print(f'{num_deleted} deleted versions across {len(resp)} pages')
-        resp = bucket.objects.delete()
-        num_deleted = sum(len(p['Deleted']) for p in resp)
-        print(f'{num_deleted} deleted objects across {len(resp)} pages')
-        print('Deleting bucket…')
-        bucket.delete()
+        print('Running in "dry run" mode; use -N to bypass "dry run" mode and actually perform deletions')
+
+    session = boto3.Session()
+    # Bucket threads list and poll; the deletion pool's threads issue the DeleteObjects requests
+    max_connections = jobs + args.bucket_jobs
+    client = session.client('s3', config=Config(max_pool_connections=max_connections, retries=dict(max_attempts=10, mode='adaptive')))
+    limiter = RateLimiter(args.max_deletes_per_sec)
+    with ThreadPoolExecutor(jobs) as delete_pool, ThreadPoolExecutor(args.bucket_jobs) as bucket_pool:
+        def process(bucket: str) -> bool:
+            try:
+                if args.expire:
+                    return expire_bucket(client, bucket, dry_run, args.poll_interval)
+                return teardown_bucket(client, bucket, dry_run, delete_pool, 2 * jobs, args.resume, limiter)
+            except Exception as e:
+                print(f'{bucket}: {e}')
+                return False
+
+        results = list(bucket_pool.map(process, buckets))
+    failed = [ bucket for bucket, ok in zip(buckets, results) if not ok ]
+    if failed:
+        print(f'Not deleted: {" ".join(failed)}')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,146 +4,668 @@
 # dependencies = [
 #     "boto3",
 #     "click",
-#     "pandas",
+#     "numpy",
+#     "pandas>=2.3",
+#     "pyarrow",
 #     "utz",
 # ]
 # ///
-import pandas as pd
-from click import argument, command, option
-import re
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from os import listdir, makedirs, remove
+from os.path import dirname, isdir, isfile, join
 from re import fullmatch
+import sqlite3
+from sys import argv, stderr
+from threading import Lock
+from urllib.parse import parse_qs, quote, unquote, urlsplit
 
-from utz import basename, concat, DF, dirname, dt, env, exists, o, process, splitext, sxs, to_dt, urlparse
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from botocore.config import Config
+from click import argument, Choice, ClickException, command, group, option
 
+from utz import basename, concat, env, exists, splitext, to_dt, urlparse
 
-LINE_RGX = '(?P<mtime>\d{4}-\d{2}-\d{2} \d\d:\d\d:\d\d) +(?P<size>\d+) (?P<key>.*)'
 
+DEFAULT_JOBS = 16
 
-def parse_line(line):
-    m = re.fullmatch(LINE_RGX, line)
-    if not m:
-        raise ValueError(f'Unrecognized line: {line}')
 
-    mtime = to_dt(m['mtime'])
-    size = int(m['size'])
-    key = m['key']
-    return o(mtime=mtime, size=size, key=key)
+def s3_client(jobs: int = DEFAULT_JOBS, endpoint_url: str | None = None):
+    # One pooled client, shared by all listing threads
+    return boto3.client('s3', endpoint_url=endpoint_url, config=Config(max_pool_connections=jobs))
 
 
-def dirs(file):
-    rv = [file]
-    cur = file
-    while True:
-        dir = dirname(cur)
-        if dir == cur:
-            break
-        else:
-            rv.append(dir)
-            cur = dir
-    return list(reversed(rv))
+def page_columns(page, extra: bool) -> dict:
+    """Columnar chunk for the objects in a `ListObjectsV2` response page, so that no per-object Python objects outlive
+    the page: ``dirs`` (the page's distinct parent "directories", e.g. ``'a/b/'``), ``dir`` (int32 codes into
+    ``dirs``), ``name`` (Arrow strings), ``size`` and ``mtime`` (epoch seconds; int64 NumPy arrays), and, if
+    ``extra``, ``storage_class`` and ``etag`` (Arrow strings)."""
+    objs = page.get('Contents', [])
+    dirs = {}
+    codes = np.empty(len(objs), dtype=np.int32)
+    names = []
+    for i, obj in enumerate(objs):
+        key = obj['Key']
+        j = key.rfind('/') + 1
+        codes[i] = dirs.setdefault(key[:j], len(dirs))
+        names.append(key[j:])
+    chunk = dict(
+        dirs=list(dirs),
+        dir=codes,
+        name=pa.array(names, pa.string()),
+        size=np.fromiter((obj['Size'] for obj in objs), np.int64, len(objs)),
+        mtime=np.fromiter((int(obj['LastModified'].timestamp()) for obj in objs), np.int64, len(objs)),
+    )
+    if extra:
+        chunk['storage_class'] = pa.array([ obj.get('StorageClass') for obj in objs ], pa.string())
+        chunk['etag'] = pa.array([ obj.get('ETag', '').strip('"') for obj in objs ], pa.string())
+    return chunk
+
+
+def arrow_strings(typ: pa.DataType):
+    """`to_pandas` ``types_mapper`` keeping Arrow strings Arrow-backed (pandas 3's default, but object dtype under
+    pandas 2)."""
+    if pa.types.is_string(typ) or pa.types.is_large_string(typ):
+        return pd.StringDtype('pyarrow', na_value=np.nan)
+
+
+def concat_chunks(chunks: list[dict], extra: bool) -> pd.DataFrame:
+    """Merge `page_columns` chunks, re-interning each page's ``dirs`` into one shared set of categories."""
+    dirs = {}
+    codes = []
+    for chunk in chunks:
+        remap = np.array([ dirs.setdefault(d, len(dirs)) for d in chunk['dirs'] ], dtype=np.int32)
+        codes.append(remap[chunk['dir']])
+
+    def numpy_col(col):
+        return np.concatenate([ chunk[col] for chunk in chunks ] or [ np.empty(0, np.int64) ])
+
+    def arrow_col(col):
+        return pa.chunked_array([ chunk[col] for chunk in chunks ], pa.string()).to_pandas(types_mapper=arrow_strings)
+
+    files = pd.DataFrame(dict(
+        dir=pd.Categorical.from_codes(np.concatenate(codes or [ np.empty(0, np.int32) ]), categories=list(dirs)),
+        name=arrow_col('name'),
+        size=numpy_col('size'),
+        mtime=pd.to_datetime(numpy_col('mtime'), unit='s', utc=True),
+    ))
+    if extra:
+        files['storage_class'] = arrow_col('storage_class')
+        files['etag'] = arrow_col('etag')
+    return files
+
+
+def file_paths(files: pd.DataFrame, prefix: str = '') -> pd.Series:
+    """Keys of `list_objects` rows, relative to ``prefix`` (joined from their interned ``dir`` and ``name`` in
+    Arrow)."""
+    dirs = pa.array([ d[len(prefix):] for d in files['dir'].cat.categories ], pa.large_string())
+    dirs = pc.take(dirs, pa.array(files['dir'].cat.codes.to_numpy()))
+    names = pa.array(files['name']).cast(pa.large_string())
+    paths = pc.binary_join_element_wise(dirs, names, pa.scalar('', pa.large_string()))
+    return pd.Series(paths.to_pandas(types_mapper=arrow_strings), index=files.index)
+
+
+def list_level(client, bucket: str, prefix: str, extra: bool) -> tuple[list[dict], list[str]]:
+    """List one "directory" level (`Delimiter='/'`): objects directly under ``prefix``, and its sub-prefixes."""
+    chunks = []
+    prefixes = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        chunks.append(page_columns(page, extra))
+        prefixes += [ cp['Prefix'] for cp in page.get('CommonPrefixes', []) ]
+    return chunks, prefixes
+
+
+def list_shard(client, bucket: str, prefix: str, extra: bool) -> list[dict]:
+    return [
+        page_columns(page, extra)
+        for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix)
+    ]
+
+
+def list_objects(
+    client,
+    bucket: str,
+    prefix: str,
+    jobs: int = DEFAULT_JOBS,
+    max_shard_depth: int = 2,
+    extra: bool = False,
+) -> pd.DataFrame:
+    """List all objects under ``prefix`` with `ListObjectsV2`, sharded across ``jobs`` threads.
+
+    Sub-prefixes are discovered one level at a time (with `Delimiter='/'`), until there are at least ``jobs`` of them
+    (or ``max_shard_depth`` levels have been expanded); each is then listed recursively in parallel. Returns a compact
+    DataFrame with columns ``dir`` (Categorical parent "directory", e.g. ``'a/b/'``), ``name`` (Arrow-backed strings;
+    see `file_paths`), ``size`` (int64), ``mtime`` (UTC datetime64), and ``storage_class``, ``etag``, if ``extra``.
+    """
+    chunks = []
+    shards = [prefix]
+    with ThreadPoolExecutor(jobs) as pool:
+        for _ in range(max_shard_depth):
+            if len(shards) >= jobs:
+                break
+            levels = list(pool.map(lambda p: list_level(client, bucket, p, extra), shards))
+            shards = []
+            for level_chunks, level_prefixes in levels:
+                chunks += level_chunks
+                shards += level_prefixes
+            if not shards:
+                break
+        for shard_chunks in pool.map(lambda p: list_shard(client, bucket, p, extra), shards):
+            chunks += shard_chunks
+
+    return concat_chunks(chunks, extra)
+
+
+def agg_dirs(files, k='path', parents: pd.Series | None = None):
+    """Return ``files`` (with ``type='file'``), plus one row per ancestor directory (``type='dir'``, including the
+    root, ``''``), with total ``size``, max ``mtime``, and ``num_descendents`` (number of files beneath it).
+
+    Each pass maps the previous pass's rows to their parent directories and groups them, so every file contributes
+    to each of its ancestors exactly once, and the number of rows shrinks as the passes move up the tree. If given,
+    ``parents`` (each file's parent directory, e.g. a Categorical) is grouped by in the first pass, instead of
+    splitting every file's path.
+    """
+    aggs = dict(size=('size', 'sum'), mtime=('mtime', 'max'), num_descendents=('num_descendents', 'sum'))
+    files = files.assign(type='file', num_descendents=1)
+    cur = files[[k, 'size', 'mtime', 'num_descendents']]
+    levels = []
+    while not cur.empty:
+        if parents is None:
+            parents = cur[k].str.rpartition('/')[0]
+        cur = cur.assign(**{k: parents}).groupby(k, sort=False, observed=True).agg(**aggs).reset_index()
+        cur[k] = cur[k].astype(str)
+        parents = None
+        levels.append(cur)
+        # The root has no parent (a folder marker at the root itself, with path '', is still counted by the root)
+        cur = cur[cur[k] != '']
+    cols = [k, 'type', 'mtime', 'size', 'num_descendents']
+    # Any other file columns (e.g. `storage_class`, `etag`) are left empty for dirs
+    extra_cols = [ c for c in files.columns if c not in cols ]
+    if not levels:
+        return files[cols + extra_cols]
+    dirs = concat(levels).groupby(k, sort=False).agg(**aggs).reset_index()
+    dirs['type'] = 'dir'
+    return concat([files[cols + extra_cols], dirs[cols]], ignore_index=True)
+
+
+STORE_SCHEMA = {
+    'bucket': 'TEXT NOT NULL',
+    'key': 'TEXT NOT NULL',
+    'type': 'TEXT',
+    'mtime': 'TEXT',
+    'size': 'INTEGER',
+    'num_descendents': 'INTEGER',
+    'storage_class': 'TEXT',
+    'etag': 'TEXT',
+    'checked_dt': 'TEXT',
+}
+
+
+CHANGES_SCHEMA = {
+    'bucket': 'TEXT NOT NULL',
+    'key': 'TEXT NOT NULL',
+    'type': 'TEXT',
+    'old_size': 'INTEGER',
+    'new_size': 'INTEGER',
+    'old_mtime': 'TEXT',
+    'new_mtime': 'TEXT',
+    'checked_dt': 'TEXT',
+}
+
+
+def prefix_range(prefix: str) -> tuple[str, str | None]:
+    """``[lo, hi)`` key range containing exactly the keys that start with ``prefix`` (``hi=None``: unbounded)."""
+    if not prefix:
+        return '', None
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def ancestor_dirs(prefix: str) -> list[str]:
+    """Strict ancestors of dir key ``prefix``, e.g. ``'a/b/'`` → ``['a/', '']``."""
+    rv = []
+    while prefix:
+        prefix = prefix[:prefix.rstrip('/').rfind('/') + 1]
+        rv.append(prefix)
+    return rv
+
+
+def snapshot_delta(prev: pd.DataFrame, cur: pd.DataFrame, ancestors: pd.DataFrame, prefix: str):
+    """Compare the previous rows under a re-scanned ``prefix`` with the new scan (``cur``).
+
+    Rows are identified by ``(key, type)``: a folder-marker object (e.g. ``a/``) is a file row with the same key as
+    its dir row. Returns the ``(key, type)`` pairs to remove, the ``ancestors`` rows updated with the change in the
+    scan root's totals, counts of overwritten / changed / new / removed rows, and a ``changes`` DataFrame (``key``,
+    ``type``, ``old_{size,mtime}``, ``new_{size,mtime}``) of the rows that were added, modified, or removed.
+    """
+    merged = cur[['key', 'type', 'size', 'mtime']].merge(
+        prev[['key', 'type', 'size', 'mtime']],
+        on=['key', 'type'], how='outer', suffixes=('', '_prev'), indicator=True,
+    )
+    both = merged['_merge'] == 'both'
+    is_changed = both & ((merged['size'] != merged['size_prev']) | (merged['mtime'] != merged['mtime_prev']))
+    is_new = merged['_merge'] == 'left_only'
+    is_removed = merged['_merge'] == 'right_only'
+    removed = merged.loc[is_removed, ['key', 'type']]
+    counts = dict(
+        overwritten=int(both.sum()),
+        changed=int(is_changed.sum()),
+        new=int(is_new.sum()),
+        removed=int(is_removed.sum()),
+    )
+    changes = merged[is_changed | is_new | is_removed]
+    changes = pd.DataFrame(dict(
+        key=changes['key'],
+        type=changes['type'],
+        old_size=changes['size_prev'].astype('Int64'),
+        new_size=changes['size'].astype('Int64'),
+        old_mtime=changes['mtime_prev'],
+        new_mtime=changes['mtime'],
+    ))
+
+    def root_totals(df):
+        root = df[(df['key'] == prefix) & (df['type'] == 'dir')]
+        if root.empty:
+            return 0, 0
+        return int(root['size'].iloc[0]), int(root['num_descendents'].iloc[0])
+
+    cur_size, cur_num = root_totals(cur)
+    prev_size, prev_num = root_totals(prev)
+    prev_ancestors = ancestors
+    ancestors = ancestors.copy()
+    ancestors['size'] += cur_size - prev_size
+    ancestors['num_descendents'] += cur_num - prev_num
+    # Can overstate ancestors' mtimes when the newest object under `prefix` was deleted (they're only ever raised)
+    cur_mtime = cur['mtime'].max()
+    if not pd.isna(cur_mtime):
+        ancestors['mtime'] = ancestors['mtime'].where(ancestors['mtime'] >= cur_mtime, cur_mtime)
+    if cur_size != prev_size:
+        changes = concat([ changes, pd.DataFrame(dict(
+            key=ancestors['key'],
+            type=ancestors['type'],
+            old_size=prev_ancestors['size'],
+            new_size=ancestors['size'],
+            old_mtime=prev_ancestors['mtime'],
+            new_mtime=ancestors['mtime'],
+        )) ])
+    return removed, ancestors, counts, changes
+
+
+def normalize_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Align ``df`` to `STORE_SCHEMA`'s columns, with UTC timestamps."""
+    df = df.reindex(columns=list(STORE_SCHEMA))
+    for col in ['mtime', 'checked_dt']:
+        df[col] = to_dt(df[col], utc=True, format='ISO8601')
+    return df
+
+
+def log_delta(output_path: str, num_prev: int, num_in_range: int, counts: dict[str, int], num_ancestors: int):
+    print(
+        f"Updating {output_path}: {num_prev} previous records, {num_prev - num_in_range} passing through, "
+        f"{counts['overwritten']} overwritten ({counts['changed']} changed), {counts['new']} new, "
+        f"{counts['removed']} removed, {num_ancestors} ancestors updated"
+    )
+
+
+def sql_value(v):
+    if pd.isna(v):
+        return None
+    if isinstance(v, pd.Timestamp):
+        return str(v)
+    return v.item() if hasattr(v, 'item') else v
+
+
+def sql_records(df: pd.DataFrame) -> list[tuple]:
+    return [ tuple(sql_value(v) for v in row) for row in df.itertuples(index=False) ]
+
+
+def sqlite_table(db_path: str) -> str:
+    return basename(splitext(db_path)[0])
 
 
-def flatmap(self, func):
-    dfs = []
-    for idx, row in self.iterrows():
-        df = func(row)
-        dfs.append(df)
-    return concat(dfs)
+def init_sqlite(conn: sqlite3.Connection, table: str, output_path: str):
+    """Create (or add missing columns to) the usage table and its ``_changes`` log.
 
+    Tables written by older versions (with `DataFrame.to_sql`'s ``index`` column, and dir keys without a trailing
+    ``/``) can't be updated in place, and are rejected."""
+    existing = { row[1] for row in conn.execute(f'PRAGMA table_info("{table}")') }
+    if 'index' in existing:
+        raise ClickException(
+            f'{output_path}: table "{table}" was written by an older s3-usage.py, whose keys are incompatible with '
+            f'incremental updates; move it aside (or drop the table) and re-scan'
+        )
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({", ".join(f"{c} {t}" for c, t in STORE_SCHEMA.items())})')
+    existing = { row[1] for row in conn.execute(f'PRAGMA table_info("{table}")') }
+    for col, typ in STORE_SCHEMA.items():
+        if col not in existing:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN {col} {typ.replace(" NOT NULL", "")}')
+    # Folder-marker objects (e.g. `a/`) share their dir row's key, so rows are unique per (bucket, key, type)
+    conn.execute(f'DROP INDEX IF EXISTS "{table}_bucket_key"')
+    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_bucket_key_type" ON "{table}" (bucket, key, type)')
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}_changes" ({", ".join(f"{c} {t}" for c, t in CHANGES_SCHEMA.items())})')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_changes_bucket_key" ON "{table}_changes" (bucket, key)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "{table}_changes_checked_dt" ON "{table}_changes" (checked_dt)')
 
-DF.flatmap = flatmap
 
+def update_sqlite(output_path: str, bucket: str, prefix: str, cur: pd.DataFrame, now: pd.Timestamp):
+    """Upsert a scan of ``s3://{bucket}/{prefix}`` (taken at ``now``) into a SQLite table (indexed on ``(bucket, key,
+    type)``), touching only rows under ``prefix`` (and its ancestors' totals), and append the rows that changed to
+    ``<table>_changes``."""
+    table = sqlite_table(output_path)
+    cols = list(STORE_SCHEMA)
+    with sqlite3.connect(output_path) as conn:
+        init_sqlite(conn, table, output_path)
 
-def expand_file_row(r):
-    file = r['key']
-    file_df = r.to_frame().transpose()
-    ancestors = dirs(file)
-    dirs_df = DF([ dict(mtime=r['mtime'], size=r['size'], key=dir, type='dir') for dir in ancestors ])
-    rows = concat([file_df, dirs_df]).reset_index(drop=True)
-    return rows
+        lo, hi = prefix_range(prefix)
+        where = 'bucket = ? AND key >= ?' + (' AND key < ?' if hi else '')
+        params = [bucket, lo] + ([hi] if hi else [])
+        prev = normalize_rows(pd.read_sql_query(f'SELECT {", ".join(cols)} FROM "{table}" WHERE {where}', conn, params=params))
+        ancestor_keys = ancestor_dirs(prefix)
+        ancestors = normalize_rows(pd.read_sql_query(
+            f'SELECT {", ".join(cols)} FROM "{table}" WHERE bucket = ? AND key IN ({", ".join("?" * len(ancestor_keys))}) AND type = \'dir\'',
+            conn,
+            params=[bucket, *ancestor_keys],
+        ))
+        [num_prev] = conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()
 
+        removed, ancestors, counts, changes = snapshot_delta(prev, cur, ancestors, prefix)
+        upserts = concat([ normalize_rows(cur), ancestors ])
+        conn.executemany(
+            f'INSERT INTO "{table}" ({", ".join(cols)}) VALUES ({", ".join("?" * len(cols))}) '
+            f'ON CONFLICT (bucket, key, type) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in cols[3:])}',
+            sql_records(upserts),
+        )
+        conn.executemany(
+            f'DELETE FROM "{table}" WHERE bucket = ? AND key = ? AND type = ?',
+            [ (bucket, key, type) for key, type in removed.itertuples(index=False) ],
+        )
+        changes = changes.assign(bucket=bucket, checked_dt=now)[list(CHANGES_SCHEMA)]
+        conn.executemany(
+            f'INSERT INTO "{table}_changes" ({", ".join(CHANGES_SCHEMA)}) VALUES ({", ".join("?" * len(CHANGES_SCHEMA))})',
+            sql_records(changes),
+        )
+    log_delta(output_path, num_prev, len(prev), counts, len(ancestors))
 
-def agg_dirs(files, k='path'):
-    files['type'] = 'file'
-    expanded = files.flatmap(expand_file_row)
-    groups = expanded.groupby([k, 'type',])
-    if len(groups) == len(files):
-        return files
-    sizes = groups['size'].sum()
-    mtimes = groups['mtime'].max()
-    num_descendents = groups.size().rename('num_descendents')
-    aggd = sxs(mtimes, sizes, num_descendents).reset_index()
-    return aggd
 
+def partition(key: str) -> str:
+    """Top-level path component of ``key`` (``''`` for the bucket root and top-level files)."""
+    top, sep, _ = key.partition('/')
+    return top if sep else ''
 
-def strip_prefix(key, prefix):
-    if key.startswith(prefix):
-        return key[len(prefix):]
+
+def partition_path(output_path: str, bucket: str, top: str) -> str:
+    name = f"prefix={quote(top, safe='')}.parquet" if top else 'root.parquet'
+    return join(output_path, quote(bucket, safe=''), name)
+
+
+def update_parquet(output_path: str, bucket: str, prefix: str, cur: pd.DataFrame):
+    """Merge a scan of ``s3://{bucket}/{prefix}`` into a Parquet dataset directory partitioned by bucket and top-level
+    prefix (``<output_path>/<bucket>/prefix=<top>.parquet``), rewriting only the partitions it touches."""
+    if isfile(output_path):
+        raise ClickException(
+            f"{output_path} is a single-file snapshot written by an older s3-usage.py; partitioned snapshots are "
+            f"written to a directory, so move it aside and re-scan"
+        )
+    if prefix:
+        tops = { partition(prefix), '' }
     else:
-        raise ValueError(f"Key {key} doesn't start with expected prefix {prefix}")
+        bucket_dir = join(output_path, quote(bucket, safe=''))
+        tops = set(cur['key'].map(partition)) | {
+            unquote(name[len('prefix='):-len('.parquet')]) if name.startswith('prefix=') else ''
+            for name in (listdir(bucket_dir) if isdir(bucket_dir) else [])
+            if name.endswith('.parquet')
+        }
+    paths = { top: partition_path(output_path, bucket, top) for top in tops }
+    prev_all = concat(
+        [ pd.read_parquet(path) for path in paths.values() if exists(path) ]
+        or [ pd.DataFrame(columns=list(STORE_SCHEMA)) ]
+    )
+    prev_all = normalize_rows(prev_all)
+    lo, hi = prefix_range(prefix)
+    in_range = (prev_all['key'] >= lo) & ((prev_all['key'] < hi) if hi else True)
+    ancestor_keys = ancestor_dirs(prefix)
+    is_ancestor = prev_all['key'].isin(ancestor_keys) & (prev_all['type'] == 'dir')
+    prev = prev_all[in_range]
 
+    removed, ancestors, counts, _ = snapshot_delta(prev, cur, prev_all[is_ancestor], prefix)
+    merged = concat([ prev_all[~in_range & ~is_ancestor], normalize_rows(cur), ancestors ]).sort_values(['key', 'type'])
+    parts = merged['key'].map(partition)
+    for top, path in paths.items():
+        rows = merged[parts == top]
+        if rows.empty:
+            if exists(path):
+                remove(path)
+            continue
+        makedirs(dirname(path), exist_ok=True)
+        rows.to_parquet(path, index=False)
+    log_delta(output_path, len(prev_all), len(prev), counts, len(ancestors))
 
-@command('s3-usage')
-@option('-o', '--output-path')
-@option('-p', '--profile', help='AWS profile to use')
-@argument('path')
-def main(path, output_path, profile):
-    if profile:
-        env['AWS_PROFILE'] = profile
 
+def parse_s3_url(path: str) -> tuple[str, str]:
+    """Split an S3 URL (``s3://`` optional) into its bucket and directory prefix (``''``, or ending in ``/``)."""
     url = urlparse(path)
-    if url.scheme is None:
-        print('Prepending "s3://"')
+    if not url.scheme:
+        print('Prepending "s3://"', file=stderr)
         path = f's3://{path}'
 
     m = fullmatch('s3://(?P<bucket>[^/]+)(?:/(?P<root_key>.*))?', path)
     if not m:
         raise ValueError(f'Unrecognized S3 URL: {path}')
-    bucket = m['bucket']
     root_key = m['root_key'] or ''
+    prefix = f'{root_key.rstrip("/")}/' if root_key else ''
+    return m['bucket'], prefix
+
+
+@command('s3-usage')
+@option('-d', '--max-shard-depth', type=int, default=2, help='Expand at most this many "directory" levels when sharding the listing (default: 2)')
+@option('-e', '--endpoint-url', help='S3 endpoint URL (e.g. for MinIO or moto)')
+@option('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Number of parallel listing threads (default: {DEFAULT_JOBS})')
+@option('-o', '--output-path')
+@option('-p', '--profile', help='AWS profile to use')
+@option('-x', '--extra', is_flag=True, help='Also collect each object\'s storage class and ETag')
+@argument('path')
+def main(path, max_shard_depth, endpoint_url, jobs, output_path, profile, extra):
+    if profile:
+        env['AWS_PROFILE'] = profile
 
-    now = to_dt(dt.now())
-    lines = process.lines('aws', 's3', 'ls', '--recursive', path)
-    files = DF([ parse_line(line) for line in lines ])
-    files['path'] = files['key'].apply(strip_prefix, prefix=f'{root_key}/')
-    aggd = agg_dirs(files).sort_values('path')
+    bucket, prefix = parse_s3_url(path)
+    now = pd.Timestamp.now(tz='UTC')
+    client = s3_client(jobs=jobs, endpoint_url=endpoint_url)
+    files = list_objects(client, bucket, prefix, jobs=jobs, max_shard_depth=max_shard_depth, extra=extra)
+    aggd = agg_dirs(
+        files.assign(path=file_paths(files, prefix)).drop(columns=['dir', 'name']),
+        parents=files['dir'].cat.rename_categories(lambda d: d[len(prefix):-1]),
+    ).sort_values('path')
+    del files
     aggd['bucket'] = bucket
-    aggd['root_key'] = root_key
-    aggd['key'] = aggd['root_key'] + '/' + aggd['path']
+    # Dir keys end with "/" (the scan root's key is `prefix` itself), so each dir's subtree is a contiguous key range
+    is_dir = (aggd['type'] == 'dir') & (aggd['path'] != '')
+    aggd['key'] = prefix + aggd['path'].where(~is_dir, aggd['path'] + '/')
     aggd['checked_dt'] = now
-    aggd = aggd.drop(columns=['path', 'root_key'])
+    aggd = aggd.drop(columns=['path'])
 
     if output_path:
-
-        def merge(prev, cur):
-            passthrough = prev[(prev.bucket != bucket)]
-            if root_key:
-                passthrough = concat([ passthrough, prev[(prev.bucket == bucket) & ~(prev.key.str.startswith(root_key))] ])
-            merged = concat([ cur, passthrough ]).sort_values(['bucket', 'key'])
-            num_passthrough = len(passthrough)
-            num_overwritten = len(prev) - num_passthrough
-            num_new = len(cur) - num_overwritten
-            print(f"Overwriting {output_path}: {len(prev)} previous records, {num_passthrough} passing through, {num_overwritten} overwritten {num_new} new")
-            return merged
-
-        base, ext = splitext(output_path)
+        _, ext = splitext(output_path.rstrip('/'))
         if ext in {'.db', '.sqlite'}:
-            sqlite_url = f'sqlite:///{output_path}'
-            name = basename(base)
-            if exists(output_path):
-                prev = pd.read_sql_table(name, sqlite_url)
-                aggd = merge(prev, aggd)
-            aggd.to_sql(name, sqlite_url, if_exists='replace')
+            update_sqlite(output_path, bucket, prefix, aggd, now)
         elif ext in {'.pqt', '.parquet'}:
-            if exists(output_path):
-                prev = pd.read_parquet(output_path)
-                aggd = merge(prev, aggd)
-            aggd.to_parquet(output_path)
+            update_parquet(output_path, bucket, prefix, aggd)
         else:
             raise ValueError(f'Unrecognized output path type: {output_path}')
 
     print(aggd)
 
 
+def key_range_clause(bucket: str, prefix: str) -> tuple[str, list[str]]:
+    lo, hi = prefix_range(prefix)
+    return 'bucket = ? AND key >= ?' + (' AND key < ?' if hi else ''), [bucket, lo] + ([hi] if hi else [])
+
+
+def query_rows(conn: sqlite3.Connection, sql: str, params: list) -> list[dict]:
+    cursor = conn.execute(sql, params)
+    cols = [ d[0] for d in cursor.description ]
+    return [ dict(zip(cols, row)) for row in cursor ]
+
+
+def query_sum(conn: sqlite3.Connection, table: str, bucket: str, prefix: str) -> dict:
+    """Total size / max mtime / number of files under ``prefix``: one index lookup of its dir row, falling back to
+    summing the files in its key range."""
+    [row] = query_rows(
+        conn,
+        f'SELECT key, size, mtime, num_descendents, checked_dt FROM "{table}" WHERE bucket = ? AND key = ? AND type = \'dir\'',
+        [bucket, prefix],
+    ) or [None]
+    if row:
+        return row
+    where, params = key_range_clause(bucket, prefix)
+    [row] = query_rows(
+        conn,
+        f'SELECT ? AS key, coalesce(sum(size), 0) AS size, max(mtime) AS mtime, count(*) AS num_descendents, max(checked_dt) AS checked_dt '
+        f'FROM "{table}" WHERE {where} AND type = \'file\'',
+        [prefix, *params],
+    )
+    return row
+
+
+def query_top(conn: sqlite3.Connection, table: str, bucket: str, prefix: str, n: int, type: str | None) -> list[dict]:
+    """The ``n`` largest entries (of ``type``, if given) under ``prefix`` (a range scan of the ``(bucket, key, type)``
+    index)."""
+    where, params = key_range_clause(bucket, prefix)
+    if type:
+        where += ' AND type = ?'
+        params.append(type)
+    return query_rows(
+        conn,
+        f'SELECT key, type, size, mtime, num_descendents FROM "{table}" WHERE {where} AND NOT (key = ? AND type = \'dir\') ORDER BY size DESC LIMIT ?',
+        [*params, prefix, n],
+    )
+
+
+def parse_since(since: str) -> str:
+    """Parse an absolute time, or a duration ago (e.g. ``7d``, ``12h``), to the stored (UTC) timestamp format."""
+    try:
+        return str(pd.Timestamp.now(tz='UTC') - pd.Timedelta(since))
+    except ValueError:
+        return str(to_dt(since, utc=True))
+
+
+def query_diff(conn: sqlite3.Connection, table: str, bucket: str, prefix: str, since: str, n: int | None) -> list[dict]:
+    """Net change of each entry under ``prefix`` across scans since ``since`` (largest absolute size change first)."""
+    where, params = key_range_clause(bucket, prefix)
+    sql = (
+        f'SELECT key, type, old_size, new_size, first_checked, last_checked FROM ('
+        f'  SELECT key, type,'
+        f'    first_value(old_size) OVER w AS old_size, last_value(new_size) OVER w AS new_size,'
+        f'    first_value(checked_dt) OVER w AS first_checked, last_value(checked_dt) OVER w AS last_checked,'
+        f'    row_number() OVER (PARTITION BY key, type ORDER BY checked_dt DESC, rowid DESC) AS rn'
+        f'  FROM "{table}_changes" WHERE {where} AND checked_dt >= ?'
+        f'  WINDOW w AS (PARTITION BY key, type ORDER BY checked_dt, rowid ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)'
+        f') WHERE rn = 1 AND coalesce(old_size, -1) != coalesce(new_size, -1) '
+        f'ORDER BY abs(coalesce(new_size, 0) - coalesce(old_size, 0)) DESC'
+    )
+    params.append(parse_since(since))
+    if n:
+        sql += ' LIMIT ?'
+        params.append(n)
+    return query_rows(conn, sql, params)
+
+
+def open_db(db_path: str) -> tuple[sqlite3.Connection, str]:
+    if not exists(db_path):
+        raise ClickException(f"{db_path} not found")
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+    return conn, sqlite_table(db_path)
+
+
+def print_rows(rows: list[dict]):
+    print(pd.DataFrame(rows).to_string(index=False) if rows else '(no results)')
+
+
+@group('s3-usage query')
+def query():
+    """Query a SQLite snapshot written by `s3-usage -o <path>.db`."""
+
+
+@query.command('sum')
+@argument('db_path')
+@argument('url')
+def query_sum_cmd(db_path, url):
+    """Total size of the objects under URL."""
+    conn, table = open_db(db_path)
+    print_rows([ query_sum(conn, table, *parse_s3_url(url)) ])
+
+
+@query.command('top')
+@option('-n', '--num', type=int, default=50, help='Number of entries to print (default: 50)')
+@option('-t', '--type', type=Choice(['dir', 'file']), help='Only print dirs or files')
+@argument('db_path')
+@argument('url')
+def query_top_cmd(num, type, db_path, url):
+    """Largest entries under URL."""
+    conn, table = open_db(db_path)
+    print_rows(query_top(conn, table, *parse_s3_url(url), n=num, type=type))
+
+
+@query.command('diff')
+@option('-n', '--num', type=int, help='Number of entries to print (default: all)')
+@option('-s', '--since', default='7d', help='Time (e.g. "2025-01-01"), or duration ago (e.g. "7d", the default)')
+@argument('db_path')
+@argument('url')
+def query_diff_cmd(num, since, db_path, url):
+    """Entries under URL whose size changed since a given time."""
+    conn, table = open_db(db_path)
+    print_rows(query_diff(conn, table, *parse_s3_url(url), since=since, n=num))
+
+
+@query.command('serve')
+@option('-h', '--host', default='127.0.0.1', help='Host to bind (default: 127.0.0.1)')
+@option('-p', '--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+@argument('db_path')
+def query_serve_cmd(host, port, db_path):
+    """Serve queries as JSON over HTTP: `/sum?url=…`, `/top?url=…[&n=50][&type=dir]`, `/diff?url=…[&since=7d][&n=…]`."""
+    conn, table = open_db(db_path)
+    lock = Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = { k: v[-1] for k, v in parse_qs(url.query).items() }
+            try:
+                bucket, prefix = parse_s3_url(params['url'])
+                with lock:
+                    if url.path == '/sum':
+                        body = query_sum(conn, table, bucket, prefix)
+                    elif url.path == '/top':
+                        body = query_top(conn, table, bucket, prefix, n=int(params.get('n', 50)), type=params.get('type'))
+                    elif url.path == '/diff':
+                        n = params.get('n')
+                        body = query_diff(conn, table, bucket, prefix, since=params.get('since', '7d'), n=int(n) if n else None)
+                    else:
+                        self.send_error(404)
+                        return
+                status = 200
+            except KeyError as e:
+                status, body = 400, dict(error=f'Missing parameter: {e.args[0]}')
+            except ValueError as e:
+                status, body = 400, dict(error=str(e))
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f'Serving {db_path} on http://{host}:{port}', file=stderr)
+    server.serve_forever()
+
+
 if __name__ == '__main__':
-    main()
+    if argv[1:2] == ['query']:
+        query.main(args=argv[2:], prog_name='s3-usage query')
+    else:
+        main()
@@ -0,0 +1,114 @@
+"""S3 helpers shared by `aws-s3-sync-include`, `aws-s3-rm-includes`, and `aws-s3-cat`: `aws s3 sync`-style
+(`fnmatch`) include globs, matched in-process against listings of only their literal prefixes, a pooled client, and
+size parsing."""
+
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+from os.path import commonprefix
+import re
+from re import Pattern
+from sys import stderr
+
+import boto3
+from botocore.config import Config
+
+
+GLOB_CHARS = set("*?[")
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+err = lambda *a, **kw: print(*a, file=stderr, **kw)
+
+
+def has_globs(pattern: str) -> bool:
+    return bool(GLOB_CHARS.intersection(pattern))
+
+
+def literal_prefix(pattern: str) -> str:
+    """Return the directory-aligned literal prefix of a glob pattern.
+
+    Returns everything up to (and including) the last `/` before the first glob
+    character.
+    """
+    pos = min((pattern.index(c) for c in GLOB_CHARS if c in pattern), default=len(pattern))
+    literal = pattern[:pos]
+    slash = literal.rfind("/")
+    return literal[: slash + 1] if slash >= 0 else ""
+
+
+def common_literal_prefix(includes: list[str]) -> str:
+    """Longest common literal prefix across all include patterns, trimmed to a
+    full path component boundary."""
+    if not includes:
+        return ""
+    literals = [literal_prefix(inc) for inc in includes]
+    prefix = commonprefix(literals)
+    slash = prefix.rfind("/")
+    return prefix[: slash + 1] if slash >= 0 else ""
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte count like `8MB`, `64MiB`, or `1.5g` (units are powers of
+    1024, as in the AWS CLI's S3 config)."""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?", value.strip().lower())
+    if not m:
+        raise ValueError(f"Unrecognized size: {value}")
+    num, unit = m.groups()
+    return int(float(num) * SIZE_UNITS[unit])
+
+
+def size_option(ctx, param, value: str | None) -> int | None:
+    return parse_size(value) if value else None
+
+
+def split_s3_url(url: str) -> tuple[str, str]:
+    bucket, _, key = url.removeprefix("s3://").partition("/")
+    return bucket, key
+
+
+def s3_client(jobs: int, retries: int):
+    """One client (connection pool sized to `jobs`) shared by all workers;
+    botocore retries throttling / 5xx / connection errors per request."""
+    config = Config(
+        max_pool_connections=jobs,
+        retries={"max_attempts": retries, "mode": "adaptive"},
+    )
+    return boto3.client("s3", config=config)
+
+
+def listing_prefixes(includes: list[str]) -> list[str]:
+    """Minimal set of directory-aligned literal prefixes covering `includes`:
+    each include's `literal_prefix`, minus those nested under another one."""
+    prefixes = []
+    for prefix in sorted(set(literal_prefix(inc) for inc in includes)):
+        # Sorted, so any covering prefix was already kept (and is the last one kept)
+        if prefixes and prefix.startswith(prefixes[-1]):
+            continue
+        prefixes.append(prefix)
+    return prefixes
+
+
+def include_matcher(includes: list[str]) -> Pattern:
+    """One compiled regex matching any of `includes` (`fnmatch` globs, as
+    `aws s3 sync --include` uses; `*` also matches `/`)."""
+    return re.compile("|".join(f"(?:{fnmatch.translate(inc)})" for inc in includes))
+
+
+def list_matching(client, bucket: str, root: str, includes: list[str], jobs: int) -> list[dict]:
+    """List each of the includes' minimal literal prefixes (see
+    `listing_prefixes`) under `root` concurrently, keeping the objects whose
+    keys (relative to `root`) match an include."""
+    matcher = include_matcher(includes)
+    prefixes = listing_prefixes(includes)
+
+    def list_prefix(prefix: str) -> list[dict]:
+        return [
+            obj
+            for page in client.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{root}{prefix}")
+            for obj in page.get("Contents", [])
+            if matcher.fullmatch(obj["Key"][len(root):])
+        ]
+
+    prefix_urls = " ".join(f"s3://{bucket}/{root}{prefix}" for prefix in prefixes)
+    err(f"Listing {len(prefixes)} prefix(es): {prefix_urls}")
+    with ThreadPoolExecutor(jobs) as pool:
+        return [obj for objs in pool.map(list_prefix, prefixes) for obj in objs]